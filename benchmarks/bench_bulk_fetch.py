@@ -0,0 +1,95 @@
+# Compares pd.read_sql over a raw DB-API connection with the batched Arrow fetch engine
+# in utils.db on a generated order-lines table. Each variant runs in a fresh process so
+# peak RSS is measured independently.
+#
+#   python -m benchmarks.bench_bulk_fetch --rows 1000000
+import argparse
+import multiprocessing
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+QUERY = """
+SELECT order_id, order_channel, order_date, despatch_date, order_value,
+       product_sku, product_qty, product_price
+FROM OrdersDespatch
+"""
+
+DTYPES = {
+    "order_channel": "category",
+    "order_date": "datetime64[ns]",
+    "despatch_date": "datetime64[ns]",
+    "order_value": "float64",
+    "product_price": "float32",
+}
+
+
+def build_table(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    order_date = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit="s")
+    df = pd.DataFrame({
+        "order_id": rng.integers(0, rows // 2, rows),
+        "order_channel": np.array(["Amazon", "eBay", "Shopify", "OnBuy", "Wholesale"])[rng.integers(0, 5, rows)],
+        "order_date": order_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "despatch_date": (order_date + pd.Timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"),
+        "order_value": rng.gamma(2.0, 20.0, rows).round(2),
+        "product_sku": np.char.add("SKU-", rng.integers(0, 20_000, rows).astype(str)),
+        "product_qty": rng.integers(1, 5, rows),
+        "product_price": rng.gamma(2.0, 5.0, rows).round(2),
+    })
+    conn = sqlite3.connect(path)
+    for start in range(0, rows, 200_000):
+        df.iloc[start:start + 200_000].to_sql("OrdersDespatch", conn, index=False, if_exists="append")
+    conn.close()
+
+
+def _run(variant, path, results):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if variant == "read_sql":
+        conn = sqlite3.connect(path)
+        df = pd.read_sql(QUERY, conn)
+        # read_sql leaves the dates as text; parse them to compare like for like
+        df["order_date"] = pd.to_datetime(df["order_date"])
+        df["despatch_date"] = pd.to_datetime(df["despatch_date"])
+        conn.close()
+    else:
+        from utils.db import SqliteBackend, run_query, set_backend
+        set_backend(SqliteBackend(path))
+        df = run_query(QUERY, dtypes=DTYPES)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results[variant] = (elapsed, (peak - baseline) / 1024, df.memory_usage(deep=True).sum() / 2**20, len(df))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "orders_lines.db")
+    ctx = multiprocessing.get_context("spawn")
+    # Linux carries ru_maxrss across fork/exec, so keep this process small and do the
+    # table generation in a child as well
+    builder = ctx.Process(target=build_table, args=(path, args.rows))
+    builder.start()
+    builder.join()
+
+    results = ctx.Manager().dict()
+    for variant in ("read_sql", "bulk_fetch"):
+        proc = ctx.Process(target=_run, args=(variant, path, results))
+        proc.start()
+        proc.join()
+
+    print(f"{args.rows:,} rows")
+    for variant, (elapsed, peak_mb, frame_mb, rows) in results.items():
+        print(f"{variant:>10}: {elapsed:6.2f}s  peak RSS +{peak_mb:7.1f} MiB  frame {frame_mb:7.1f} MiB  ({rows:,} rows)")
+
+
+if __name__ == "__main__":
+    main()
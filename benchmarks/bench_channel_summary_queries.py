@@ -0,0 +1,100 @@
+# Compares the old interpolated, CAST-wrapped channel summary query with the sargable,
+# parameterised one on a local SQLite stand-in for OrdersDespatch.
+#
+#   python -m benchmarks.bench_channel_summary_queries --rows 500000 --ranges 50
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.db import SqliteBackend, get_pool, run_query, set_backend
+from utils.queries import QueryBuilder, channel_summary
+
+LEGACY_QUERY = """
+WITH despatch_data AS (
+    SELECT DISTINCT order_id, order_channel, despatch_date, order_value
+    FROM OrdersDespatch
+    WHERE {day} BETWEEN '{start}' AND '{end}'
+),
+channel_total AS (
+    SELECT order_channel, SUM(order_value) AS total_orders_value, COUNT(DISTINCT order_id) AS orders_count
+    FROM despatch_data
+    GROUP BY order_channel
+)
+SELECT order_channel AS channel, total_orders_value, orders_count
+FROM channel_total
+ORDER BY total_orders_value DESC
+"""
+
+
+def build_standin(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    order_ids = rng.integers(0, rows // 3, rows)
+    despatch = pd.Timestamp("2024-01-01") + pd.to_timedelta(order_ids % 600, unit="D") + pd.to_timedelta(
+        rng.integers(0, 86400, rows), unit="s"
+    )
+    df = pd.DataFrame({
+        "order_id": order_ids,
+        "order_channel": np.array(["Amazon", "eBay", "Shopify", "OnBuy", "Wholesale"])[order_ids % 5],
+        "despatch_date": despatch.strftime("%Y-%m-%d %H:%M:%S"),
+        "order_value": (order_ids % 97).astype(float) + 0.99,
+    })
+    conn = sqlite3.connect(path)
+    df.to_sql("OrdersDespatch", conn, index=False)
+    conn.execute("CREATE INDEX ix_orders_despatch_date ON OrdersDespatch (despatch_date)")
+    conn.commit()
+    conn.close()
+
+
+def query_plan(sql, params=()):
+    with get_pool().connection() as conn:
+        return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--ranges", type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "orders_standin.db")
+    build_standin(path, args.rows)
+    set_backend(SqliteBackend(path), max_size=1)
+
+    rng = np.random.default_rng(1)
+    starts = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 590, args.ranges), unit="D")
+    ranges = [(start, start + pd.Timedelta(days=int(days))) for start, days in zip(starts, rng.integers(0, 7, args.ranges))]
+
+    day = QueryBuilder("OrdersDespatch", dialect="sqlite").day("despatch_date")
+    legacy_texts = [
+        LEGACY_QUERY.format(day=day, start=start.strftime("%Y-%m-%d"), end=end.strftime("%Y-%m-%d"))
+        for start, end in ranges
+    ]
+
+    print("Legacy plan:      ", query_plan(legacy_texts[0]))
+    builder = QueryBuilder("OrdersDespatch", dialect="sqlite").between_days("despatch_date", *ranges[0])
+    sql, params = builder.select(["DISTINCT order_id", "order_channel", "despatch_date", "order_value"])
+    print("Parameterised plan:", query_plan(sql, params))
+
+    t0 = time.perf_counter()
+    legacy = [run_query(text) for text in legacy_texts]
+    legacy_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    current = [channel_summary(start, end) for start, end in ranges]
+    current_s = time.perf_counter() - t0
+
+    for old, new in zip(legacy, current):
+        pd.testing.assert_frame_equal(old, new)
+
+    print(f"{args.rows:,} rows, {args.ranges} date ranges, results identical")
+    print(f"legacy:        {legacy_s:.3f}s  ({len(set(legacy_texts))} distinct statements compiled)")
+    print(f"parameterised: {current_s:.3f}s  (1 statement, re-executed on a cached cursor)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Compares the per-SKU iterrows delta allocation that used to live in
+# pages/5_routine_reports.py with the vectorised engine in utils.reconcile on a generated
+# Mintsoft export. The legacy loop is O(SKUs x rows), so by default it only runs on the
+# first --check-skus SKUs (enough to check the reports match); --full runs it on all of
+# them.
+#
+#   python -m benchmarks.bench_stock_delta --rows 500000
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.reconcile import delta_report
+
+
+def legacy_delta_report(opera_df, mintsoft_df):
+    mintsoft_total = mintsoft_df.groupby('SKU')['Mintsoft_Quantity'].sum().reset_index()
+    mintsoft_total.rename(columns={'Mintsoft_Quantity': 'Total_Mintsoft_Stock'}, inplace=True)
+
+    delta_df = opera_df.merge(mintsoft_total, on='SKU', how='inner')
+    delta_df['Delta_Stock'] = delta_df['Opera_Stock'] - delta_df['Total_Mintsoft_Stock']
+
+    final_report_list = []
+
+    for _, row in delta_df.iterrows():
+        sku = row['SKU']
+        delta_stock = row['Delta_Stock']
+        mintsoft_locations = mintsoft_df[mintsoft_df['SKU'] == sku]
+
+        if delta_stock > 0:
+            for _, loc_row in mintsoft_locations.iterrows():
+                final_report_list.append({
+                    'Client': 'MPTC',
+                    'SKU': sku,
+                    'Warehouse': 'Main',
+                    'Location': loc_row['Location'],
+                    'BestBefore': '',
+                    'BatchNo': '',
+                    'SerialNo': '',
+                    'Quantity': delta_stock,
+                    'Comment': 'Quantity added to inventory'
+                })
+                break
+
+        elif delta_stock < 0:
+            remaining_delta = abs(delta_stock)
+            mintsoft_locations = mintsoft_locations.sort_values(by=['Mintsoft_Quantity', 'Location'])
+            for _, loc_row in mintsoft_locations.iterrows():
+                if remaining_delta <= 0:
+                    break
+                loc_quantity = loc_row['Mintsoft_Quantity']
+                reduce_quantity = min(loc_quantity, remaining_delta)
+                remaining_delta -= reduce_quantity
+                final_report_list.append({
+                    'Client': 'MPTC',
+                    'SKU': sku,
+                    'Warehouse': 'Main',
+                    'Location': loc_row['Location'],
+                    'BestBefore': '',
+                    'BatchNo': '',
+                    'SerialNo': '',
+                    'Quantity': -reduce_quantity,
+                    'Comment': 'Quantity removed from inventory'
+                })
+
+    final_report = pd.DataFrame(final_report_list)
+    return final_report[final_report['Quantity'] != 0]
+
+
+def build_exports(rows, skus, seed=0):
+    # Shaped like the page's frames after column cleaning: a Mintsoft export with several
+    # locations per SKU (some empty, a few negative) and an Opera sheet that lists most of
+    # the SKUs, some twice, in its own order
+    rng = np.random.default_rng(seed)
+    sku_names = np.char.add("SKU-", np.arange(skus).astype(str))
+    mintsoft_df = pd.DataFrame({
+        'SKU': sku_names[rng.integers(0, skus, rows)],
+        'Location': np.char.add("A-", rng.integers(0, 5_000, rows).astype(str)),
+        'Mintsoft_Quantity': np.maximum(rng.integers(-2, 40, rows), rng.integers(-5, 1, rows)),
+    })
+    listed = rng.permutation(skus)[: int(skus * 0.9)]
+    listed = np.concatenate([listed, listed[: skus // 100]])
+    opera_df = pd.DataFrame({
+        'SKU': sku_names[listed],
+        'Opera_Stock': rng.integers(-10, 400, len(listed)),
+    })
+    opera_df['Opera_Stock'] = opera_df['Opera_Stock'].apply(lambda x: max(x, 0))
+    return opera_df, mintsoft_df
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--skus", type=int, default=40_000)
+    parser.add_argument("--check-skus", type=int, default=1_000)
+    parser.add_argument("--full", action="store_true", help="run the legacy loop on every SKU")
+    args = parser.parse_args()
+
+    opera_df, mintsoft_df = build_exports(args.rows, args.skus)
+    report, vector_s = timed(delta_report, opera_df, mintsoft_df)
+    print(f"{args.rows:,} Mintsoft rows, {len(opera_df):,} Opera rows -> {len(report):,} report lines")
+    print(f"vectorised: {vector_s:8.2f}s")
+
+    check = opera_df if args.full else opera_df.iloc[: args.check_skus]
+    legacy, legacy_s = timed(legacy_delta_report, check, mintsoft_df)
+    pd.testing.assert_frame_equal(legacy, delta_report(check, mintsoft_df))
+    scope = "all" if args.full else f"first {len(check):,}"
+    estimate = "" if args.full else f"  (~{legacy_s * len(opera_df) / len(check):,.0f}s projected for all)"
+    print(f"legacy:     {legacy_s:8.2f}s on the {scope} Opera rows{estimate}; reports identical")
+
+
+if __name__ == "__main__":
+    main()
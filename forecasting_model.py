@@ -1,52 +1,421 @@
 # forecasting_model.py
+import os
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
 import pandas as pd
 from prophet import Prophet
 from prophet.make_holidays import make_holidays_df
+from prophet.serialize import model_to_json
 import warnings
 
 warnings.filterwarnings("ignore")
 
-def forecast_multiple_skus(df, sku_col, date_col, qty_col, forecast_days=30):
-    forecast_results = []
-    uk_holidays = make_holidays_df(year_list=[2023, 2024, 2025], country='UK')
+MIN_HISTORY_DAYS = 30
 
-    for sku in df[sku_col].unique():
-        sku_df = df[df[sku_col] == sku].copy()
-        if sku_df[date_col].nunique() < 30:
-            continue
 
-        daily_data = (
-            sku_df.groupby(date_col)[qty_col]
-            .sum()
-            .reset_index()
-            .rename(columns={date_col: 'ds', qty_col: 'y'})
-        )
+def _fit_sku(sku, daily_data, forecast_days, holidays):
+    # Depends only on the SKU's own series: returns the ds/yhat rows after its last day and
+    # the fitted model; _trim_forecast() lines them up with the data's last date
+    model = Prophet(
+        yearly_seasonality=True,
+        weekly_seasonality=True,
+        holidays=holidays
+    )
+    model.fit(daily_data)
+
+    future = model.make_future_dataframe(periods=forecast_days)
+    forecast = model.predict(future)
+    return forecast.loc[forecast['ds'] > daily_data['ds'].max(), ['ds', 'yhat']], model_to_json(model)
+
+
+def _trim_forecast(forecast, sku, last_date):
+    # Keeps the days after last_date and numbers them from it
+    forecast_trimmed = forecast[['ds', 'yhat']].copy()
+    forecast_trimmed['product_sku'] = sku
+    forecast_trimmed['forecast_days_ahead'] = (forecast_trimmed['ds'] - last_date).dt.days
+    return forecast_trimmed[forecast_trimmed['forecast_days_ahead'] > 0]
+
+
+def _fit_chunk(tasks, forecast_days, holidays):
+    # Runs inside a worker process: fits a batch of SKUs to amortise pickling overhead
+    return [(sku, *_fit_sku(sku, daily_data, forecast_days, holidays)) for sku, daily_data in tasks]
+
+
+def _resolve_workers(n_jobs):
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def _run_tasks(tasks, forecast_days, holidays, n_jobs=1, chunk_size=None):
+    workers = min(_resolve_workers(n_jobs), max(len(tasks), 1))
+    if workers == 1:
+        for sku, daily_data in tasks:
+            yield (sku, *_fit_sku(sku, daily_data, forecast_days, holidays))
+        return
+
+    if not chunk_size:
+        # A few chunks per worker keeps cores busy while still streaming results early
+        chunk_size = max(1, len(tasks) // (workers * 4))
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+    # spawn avoids forking the multi-threaded Streamlit server process
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+        futures = [
+            executor.submit(_fit_chunk, chunk, forecast_days, holidays)
+            for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+# ------------------ FORECAST CACHE ------------------
+# Bump when the Prophet configuration in _fit_sku changes so stale entries stop matching
+MODEL_VERSION = "prophet-uk-holidays-v2"
+
+
+class ForecastCache:
+    # On-disk store of fitted model parameters and untrimmed forecast frames, one file per
+    # fingerprint, evicted least-recently-used first once max_entries or max_bytes is exceeded
+
+    def __init__(self, directory=None, max_entries=5000, max_bytes=512 * 1024 * 1024):
+        self.directory = directory or os.environ.get("MPTC_FORECAST_CACHE_DIR", ".forecast_cache")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> file size, least recently used first
+        os.makedirs(self.directory, exist_ok=True)
+
+        existing = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.directory, name))
+                existing.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    @staticmethod
+    def fingerprint(daily_data, forecast_days, holidays):
+        # Only what the fit sees: a sale of another SKU moves the data's last date but not
+        # this key, and the stored frame is trimmed against the new last date on the way out
+        digest = hashlib.sha256(MODEL_VERSION.encode())
+        digest.update(pd.util.hash_pandas_object(daily_data, index=False).values.tobytes())
+        digest.update(pd.util.hash_pandas_object(holidays, index=False).values.tobytes())
+        digest.update(f"{forecast_days}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                entry = pd.read_pickle(self._path(key))
+            except Exception:
+                # Missing or corrupt entry: treat as a miss and let the refit overwrite it
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            os.utime(self._path(key))
+            self.hits += 1
+            return entry["forecast"]
+
+    def put(self, key, forecast_frame, model_json):
+        path = self._path(key)
+        # A unique temp file per write: sessions in one process write from separate threads
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as tmp:
+            pd.to_pickle({"forecast": forecast_frame, "model": model_json}, tmp)
+        os.replace(tmp.name, path)
+        with self._lock:
+            self._entries[key] = os.path.getsize(path)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        total_bytes = sum(self._entries.values())
+        while self._entries and (len(self._entries) > self.max_entries or total_bytes > self.max_bytes):
+            key, size = self._entries.popitem(last=False)
+            total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": sum(self._entries.values()),
+            }
+
+
+def _forecast_tasks(tasks, forecast_days, last_date, holidays, n_jobs=1, chunk_size=None, cache=None, on_result=None):
+    # Returns {sku: forecast_frame}, serving unchanged SKUs from the cache and fitting the
+    # rest; either way the frame is trimmed against the current last_date
+    results = {}
+    to_fit = tasks
+    cache_keys = {}
+    if cache is not None:
+        to_fit = []
+        for sku, daily_data in tasks:
+            key = cache.fingerprint(daily_data, forecast_days, holidays)
+            cached = cache.get(key)
+            if cached is None:
+                cache_keys[sku] = key
+                to_fit.append((sku, daily_data))
+            else:
+                # Identical histories can belong to different SKUs, so label on the way out
+                results[sku] = _trim_forecast(cached, sku, last_date)
+                if on_result is not None:
+                    on_result(sku, len(results), len(tasks))
+
+    for sku, forecast, model_json in _run_tasks(to_fit, forecast_days, holidays, n_jobs, chunk_size):
+        results[sku] = _trim_forecast(forecast, sku, last_date)
+        if cache is not None:
+            cache.put(cache_keys[sku], forecast, model_json)
+        if on_result is not None:
+            on_result(sku, len(results), len(tasks))
+    return results
+
+
+# ------------------ DEMAND MATRIX ------------------
+class DemandMatrix:
+    # Dense SKU x day demand array over a contiguous daily grid, built once per data load.
+    # values holds summed quantities; observed marks days with at least one order line.
 
-        model = Prophet(
-            yearly_seasonality=True,
-            weekly_seasonality=True,
-            holidays=uk_holidays
+    def __init__(self, skus, dates, values, observed):
+        self.skus = skus
+        self.dates = dates
+        self.values = values
+        self.observed = observed
+        self._cumulative = None
+
+    @property
+    def last_date(self):
+        return self.dates[-1]
+
+    def last_observed_date(self):
+        observed_days = np.flatnonzero(self.observed.any(axis=0))
+        return self.dates[observed_days[-1]] if len(observed_days) else self.last_date
+
+    def until(self, date):
+        # Column slices are views, so trimming the grid never copies the matrix
+        end = self.dates.searchsorted(date, side='right')
+        return DemandMatrix(self.skus, self.dates[:end], self.values[:, :end], self.observed[:, :end])
+
+    def active_days(self):
+        return self.observed.sum(axis=1)
+
+    def daily_series(self, row):
+        # Same shape as the groupby-per-SKU frame Prophet was originally fitted on
+        mask = self.observed[row]
+        return pd.DataFrame({'ds': self.dates[mask], 'y': self.values[row][mask]})
+
+    def window_totals(self, days):
+        # Quantity per SKU over the last `days` grid days, from one cumulative sum per matrix
+        if self._cumulative is None:
+            self._cumulative = np.cumsum(self.values, axis=1)
+        totals = self._cumulative[:, -1].copy()
+        if days < self.values.shape[1]:
+            totals -= self._cumulative[:, -days - 1]
+        return pd.Series(totals, index=pd.Index(self.skus, name='product_sku'))
+
+
+def build_demand_matrix(df, sku_col, date_col, qty_col, end_date=None):
+    # One factorize + bincount pass over the order lines; end_date extends the grid with
+    # empty days, e.g. to the latest date of the unfiltered data
+    days = pd.to_datetime(df[date_col]).dt.normalize()
+    valid = days.notna() & df[sku_col].notna()
+    days = days[valid]
+    # factorize keeps first-seen order, matching df[sku_col].unique()
+    codes, skus = pd.factorize(df.loc[valid, sku_col], sort=False)
+    qty = df.loc[valid, qty_col].fillna(0).to_numpy(dtype=float)
+
+    if not len(days) and end_date is None:
+        return DemandMatrix(np.asarray(skus), pd.DatetimeIndex([]), np.zeros((0, 0)), np.zeros((0, 0), dtype=bool))
+    if len(days):
+        start, end = days.min(), days.max()
+    else:
+        start = end = pd.Timestamp(end_date).normalize()
+    if end_date is not None:
+        end = max(end, pd.Timestamp(end_date).normalize())
+    day_idx = (days - start).dt.days.to_numpy()
+    n_skus, n_days = len(skus), (end - start).days + 1
+    flat = codes * n_days + day_idx
+    values = np.bincount(flat, weights=qty, minlength=n_skus * n_days).reshape(n_skus, n_days)
+    observed = np.bincount(flat, minlength=n_skus * n_days).reshape(n_skus, n_days) > 0
+    dates = pd.date_range(start, periods=n_days, freq='D')
+    return DemandMatrix(np.asarray(skus), dates, values, observed)
+
+
+# ------------------ FORECASTERS ------------------
+class Forecaster:
+    # fit_predict returns one long frame with columns ds, yhat, product_sku, forecast_days_ahead
+    # for the requested matrix rows, covering the days after demand.last_date.
+
+    def fit_predict(self, demand, rows, forecast_days):
+        raise NotImplementedError
+
+
+class ProphetForecaster(Forecaster):
+    def __init__(self, n_jobs=1, chunk_size=None, cache=None, on_result=None):
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.on_result = on_result
+
+    def fit_predict(self, demand, rows, forecast_days):
+        uk_holidays = make_holidays_df(year_list=[2023, 2024, 2025], country='UK')
+        tasks = [(demand.skus[row], demand.daily_series(row)) for row in rows]
+        results = _forecast_tasks(
+            tasks, forecast_days, demand.last_date, uk_holidays,
+            self.n_jobs, self.chunk_size, self.cache, self.on_result
         )
-        model.fit(daily_data)
+        if not results:
+            return pd.DataFrame(columns=['ds', 'yhat', 'product_sku', 'forecast_days_ahead'])
+        return pd.concat([results[sku] for sku, _ in tasks], ignore_index=True)
 
-        future = model.make_future_dataframe(periods=forecast_days)
-        forecast = model.predict(future)
 
-        forecast_trimmed = forecast[['ds', 'yhat']].copy()
-        forecast_trimmed['product_sku'] = sku
-        forecast_trimmed['forecast_days_ahead'] = (forecast_trimmed['ds'] - pd.to_datetime(df[date_col].max())).dt.days
-        forecast_trimmed = forecast_trimmed[forecast_trimmed['forecast_days_ahead'] > 0]
+def _exp_weights(mask, alpha):
+    # Per-row simple exponential smoothing weights over the masked entries, initialised on the
+    # first one: w_first = (1-a)^(n-1), w_k = a(1-a)^(n-1-k); rows with no entries get zeros
+    rank = np.cumsum(mask, axis=1) - 1
+    n = mask.sum(axis=1, keepdims=True)
+    exponent = np.where(mask, n - 1 - rank, 0)
+    weights = np.where(rank == 0, 1.0, alpha) * (1 - alpha) ** exponent
+    return np.where(mask, weights, 0.0)
 
-        forecast_results.append(forecast_trimmed)
 
-    if not forecast_results:
+class NumpyForecaster(Forecaster):
+    # Batched statistical engine: every SKU is fitted at once as array operations over the
+    # demand matrix. Methods: "sba" (Syntetos-Boylan), "croston", "ses", "seasonal_naive".
+    METHODS = ("sba", "croston", "ses", "seasonal_naive")
+
+    def __init__(self, method="sba", alpha=0.1, season_length=7, seasons=4):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown method {method!r}; expected one of {self.METHODS}")
+        self.method = method
+        self.alpha = alpha
+        self.season_length = season_length
+        self.seasons = seasons
+
+    def _levels(self, y):
+        if self.method == "ses":
+            return (_exp_weights(np.ones_like(y, dtype=bool), self.alpha) * y).sum(axis=1)
+
+        # Croston: smooth non-zero demand sizes and the intervals between them separately
+        nonzero = y > 0
+        idx = np.arange(y.shape[1])
+        last_seen = np.maximum.accumulate(np.where(nonzero, idx, -1), axis=1)
+        previous = np.hstack([np.full((y.shape[0], 1), -1), last_seen[:, :-1]])
+        intervals = np.where(nonzero, idx - previous, 0)
+
+        weights = _exp_weights(nonzero, self.alpha)
+        size = (weights * y).sum(axis=1)
+        interval = (weights * intervals).sum(axis=1)
+        rate = np.divide(size, interval, out=np.zeros_like(size), where=interval > 0)
+        if self.method == "sba":
+            rate *= 1 - self.alpha / 2
+        return rate
+
+    def fit_predict(self, demand, rows, forecast_days):
+        y = demand.values[rows]
+        if self.method == "seasonal_naive":
+            # Average of the last few weeks per weekday, repeated over the horizon
+            window = min(self.season_length * self.seasons, y.shape[1]) // self.season_length * self.season_length
+            profile = y[:, y.shape[1] - window:].reshape(len(rows), -1, self.season_length).mean(axis=1)
+            yhat = profile[:, np.arange(forecast_days) % self.season_length]
+        else:
+            yhat = np.repeat(self._levels(y)[:, None], forecast_days, axis=1)
+
+        horizon = np.arange(1, forecast_days + 1)
+        return pd.DataFrame({
+            'ds': np.tile(demand.last_date + pd.to_timedelta(horizon, unit='D'), len(rows)),
+            'yhat': yhat.ravel(),
+            'product_sku': np.repeat(demand.skus[rows], forecast_days),
+            'forecast_days_ahead': np.tile(horizon, len(rows)),
+        })
+
+
+class VolumeRouter(Forecaster):
+    # Sends SKUs averaging at least min_daily_qty over the last window_days to the high-volume
+    # forecaster (Prophet by default) and the long tail to the batched NumPy engine
+    def __init__(self, high=None, low=None, min_daily_qty=1.0, window_days=90):
+        self.high = high or ProphetForecaster()
+        self.low = low or NumpyForecaster()
+        self.min_daily_qty = min_daily_qty
+        self.window_days = window_days
+
+    def split(self, demand, rows):
+        rows = np.asarray(rows, dtype=int)
+        recent = demand.values[rows, -self.window_days:].mean(axis=1)
+        is_high = recent >= self.min_daily_qty
+        return rows[is_high], rows[~is_high]
+
+    def fit_predict(self, demand, rows, forecast_days):
+        high_rows, low_rows = self.split(demand, rows)
+        frames = []
+        if len(high_rows):
+            frames.append(self.high.fit_predict(demand, high_rows, forecast_days))
+        if len(low_rows):
+            frames.append(self.low.fit_predict(demand, low_rows, forecast_days))
+        if not frames:
+            return pd.DataFrame(columns=['ds', 'yhat', 'product_sku', 'forecast_days_ahead'])
+        return pd.concat(frames, ignore_index=True)
+
+
+def forecast_multiple_skus(df, sku_col, date_col, qty_col, forecast_days=30, n_jobs=1, chunk_size=None, on_result=None, cache=None, forecaster=None, demand=None):
+    # n_jobs=1 fits serially, n_jobs=None/-1 uses every core; on_result(sku, done, total) reports progress.
+    # With a ForecastCache only SKUs whose own history, the horizon or holidays changed are refit.
+    # forecaster defaults to Prophet for every SKU; pass e.g. a VolumeRouter to mix engines.
+    # A prebuilt DemandMatrix of df can be passed to share it with other per-SKU summaries.
+    if demand is None:
+        demand = build_demand_matrix(df, sku_col, date_col, qty_col)
+    if not len(demand.skus):
         return pd.DataFrame()
+    demand = demand.until(demand.last_observed_date())
+    if forecaster is None:
+        forecaster = ProphetForecaster(n_jobs=n_jobs, chunk_size=chunk_size, cache=cache, on_result=on_result)
 
-    all_forecasts = pd.concat(forecast_results, ignore_index=True)
+    rows = np.flatnonzero(demand.active_days() >= MIN_HISTORY_DAYS)
+    if not len(rows):
+        return pd.DataFrame()
+    all_forecasts = forecaster.fit_predict(demand, rows, forecast_days)
+
+    # Engines may return SKUs in any order; restore first-seen SKU order so the output
+    # is identical however the fits were scheduled
+    sku_rank = pd.Series(np.arange(len(demand.skus)), index=demand.skus)
+    all_forecasts = all_forecasts.iloc[
+        np.argsort(sku_rank.loc[all_forecasts['product_sku']].to_numpy(), kind='stable')
+    ].reset_index(drop=True)
     all_forecasts.rename(columns={'ds': 'forecast_date', 'yhat': 'forecast_qty'}, inplace=True)
 
     # Include forecast_days_ahead in final output
     return all_forecasts[['product_sku', 'forecast_date', 'forecast_qty', 'forecast_days_ahead']]
-
-def prepare_forecast_csv(forecast_df):
-    return forecast_df.to_csv(index=False).encode("utf-8")
@@ -1,115 +1,80 @@
 import streamlit as st
 import pandas as pd
-import pyodbc
 import plotly.express as px
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from utils.datasets import refresh_button, view, window
+from utils.dateranges import QUICK_RANGES, resolve_range
+from utils.frames import compact, memory_report
+from utils.metadata import date_bounds, latest_date
+from utils.queries import daily_order_totals, line_totals
+from utils.rollups import history_start
 
 st.set_page_config(page_title="📊 MPTC Business Dashboard", layout="wide")
 st.title("🏭 Channel-wise Overview Dashboard")
 
-# ------------------ DATABASE CONNECTION ------------------
-def connect_db():
-    try:
-        return pyodbc.connect(
-            "DRIVER={ODBC Driver 17 for SQL Server};"
-            "SERVER=mptcecommerce-sql-server.database.windows.net;"
-            "DATABASE=mptcecommerce-db;"
-            "UID=mptcadmin;"
-            "PWD=Mptc@2025;"
-            "Connection Timeout=60"
-        )
-    except Exception as e:
-        st.error(f"❌ Database connection failed: {e}")
-        return None
+# ------------------ DATA SOURCE ------------------
+# Rollups: local daily summary tables. Live: filters and GROUP BYs pushed into Azure SQL.
+data_source = st.sidebar.radio("🗄️ Data Source", ["Daily rollups", "Live database (SQL pushdown)"])
+live_mode = data_source != "Daily rollups"
 
 # ------------------ LOAD DATA ------------------
-@st.cache_data
+# Daily rollups (orders deduplicated once at refresh) instead of 12 months of raw lines,
+# taken from the shared rollup datasets; the SKU rollup is only ever read as a date window
 def load_data():
-    conn = connect_db()
-    if conn is None:
-        return pd.DataFrame()
     try:
-        query = """
-        SELECT order_id, order_channel, order_date, despatch_date, order_value, 
-               order_cust_postcode, product_sku, product_name, product_qty, customer_name, 
-               product_price, order_courier_service
-        FROM OrdersDespatch
-        WHERE order_date >= DATEADD(MONTH, -12, GETDATE())
-        """
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return df
+        orders = view("order_rollup")
+        return orders[orders['order_date'] >= history_start()]
     except Exception as e:
         st.error(f"❌ Query execution failed: {e}")
         return pd.DataFrame()
 
-df = load_data()
-if df.empty:
-    st.stop()
-
-df['order_date'] = pd.to_datetime(df['order_date']).dt.normalize()
-df['despatch_date'] = pd.to_datetime(df['despatch_date']).dt.normalize()
+def load_live_options():
+    # Channel list and latest dates from the cached date-bounds lookups
+    try:
+        channels = date_bounds("OrdersDespatch", by_channel=True).index.tolist()
+        latest = {col: latest_date("OrdersDespatch", col) for col in ("despatch_date", "order_date")}
+    except Exception as e:
+        st.error(f"❌ Query execution failed: {e}")
+        return [], {}
+    return channels, latest if all(d is not None for d in latest.values()) else {}
+
+# Cached per filter tuple, so revisiting a combination never hits the database again
+@st.cache_data(ttl=600)
+def load_live_aggregates(despatch_start, despatch_end, order_start, order_end, channels):
+    filters = dict(
+        despatch_start=despatch_start, despatch_end=despatch_end,
+        order_start=order_start, order_end=order_end, channels=channels
+    )
+    return compact(daily_order_totals(**filters), label="overview/live_daily_totals"), line_totals(**filters)
+
+if live_mode:
+    channels, latest = load_live_options()
+    if not latest:
+        st.stop()
+    latest_despatch, latest_order = latest['despatch_date'], latest['order_date']
+else:
+    orders_df = load_data()
+    if orders_df.empty:
+        st.stop()
+    # Quick ranges only need the latest day, which the rollup store answers directly
+    latest_despatch = latest_date("order_rollup", "despatch_date")
+    latest_order = latest_date("order_rollup", "order_date")
+    channels = sorted(orders_df['order_channel'].dropna().unique().tolist())
 
 # ------------------ SIDEBAR DATE FILTER ------------------
 st.sidebar.header("📅 Filter by Date")
 
 despatch_date_range = st.sidebar.date_input("Despatch Date Range", [])
-despatch_quick = st.sidebar.selectbox("🕒 Quick Despatch Date Range", [
-    "None", "Yesterday", "Last 7 Days", "Last 30 Days", "Last 3 Months", "Last 6 Months", "Last 12 Months"
-])
+despatch_quick = st.sidebar.selectbox("🕒 Quick Despatch Date Range", QUICK_RANGES)
 
 order_date_range = st.sidebar.date_input("Order Date Range", [])
-order_quick = st.sidebar.selectbox("🕒 Quick Order Date Range", [
-    "None", "Yesterday", "Last 7 Days", "Last 30 Days", "Last 3 Months", "Last 6 Months", "Last 12 Months"
-])
-
-# --- Helper Function ---
-def get_range_from_option(option, available_dates):
-    if len(available_dates) == 0:
-        return None, None
-    today = max(available_dates)
-    if option == "Yesterday":
-        return today, today
-    elif option == "Last 7 Days":
-        return today - timedelta(days=6), today
-    elif option == "Last 30 Days":
-        return today - timedelta(days=29), today
-    elif option == "Last 3 Months":
-        return today - relativedelta(months=3), today
-    elif option == "Last 6 Months":
-        return today - relativedelta(months=6), today
-    elif option == "Last 12 Months":
-        return today - relativedelta(months=12), today
-    else:
-        return None, None
-
-despatch_dates = sorted(df['despatch_date'].dropna().unique())
-order_dates = sorted(df['order_date'].dropna().unique())
-
-# --- Final Despatch Date Range (Always applied) ---
-if despatch_quick != "None":
-    despatch_start, despatch_end = get_range_from_option(despatch_quick, despatch_dates)
-elif len(despatch_date_range) == 1:
-    despatch_start = despatch_end = pd.to_datetime(despatch_date_range[0])
-elif len(despatch_date_range) == 2:
-    despatch_start, despatch_end = pd.to_datetime(despatch_date_range)
-else:
-    despatch_start, despatch_end = max(despatch_dates) - timedelta(days=29), max(despatch_dates)
+order_quick = st.sidebar.selectbox("🕒 Quick Order Date Range", QUICK_RANGES)
+
+# --- Final Despatch Date Range (Always applied; defaults to the last 30 days) ---
+despatch_start, despatch_end = resolve_range(despatch_quick, despatch_date_range, latest_despatch, default_days=29)
 
 # --- Final Order Date Range (Optional only when filtered) ---
-apply_order_filter = False
-order_start = order_end = None
-
-if order_quick != "None":
-    order_start, order_end = get_range_from_option(order_quick, order_dates)
-    apply_order_filter = True
-elif len(order_date_range) == 1:
-    order_start = order_end = pd.to_datetime(order_date_range[0])
-    apply_order_filter = True
-elif len(order_date_range) == 2:
-    order_start, order_end = pd.to_datetime(order_date_range)
-    apply_order_filter = True
+apply_order_filter = order_quick != "None" or len(order_date_range) in (1, 2)
+order_start, order_end = resolve_range(order_quick, order_date_range, latest_order)
 
 # Debug
 st.caption(f"📦 Despatch Date: {despatch_start.date()} → {despatch_end.date()}")
@@ -119,34 +84,57 @@ else:
     st.caption("🧾 Order Date Not Selected")
 
 # ------------------ CHANNEL FILTER ------------------
-channels = sorted(df['order_channel'].dropna().unique().tolist())
 all_option = "Select All"
 channels_with_all = [all_option] + channels
 
 selected_channels = st.multiselect("📦 Select Sales Channel(s)", options=channels_with_all, default=all_option)
-if all_option in selected_channels or not selected_channels:
+all_channels = all_option in selected_channels or not selected_channels
+if all_channels:
     selected_channels = channels
 
 # ------------------ APPLY FILTERS ------------------
-filtered_df = df[
-    (df['despatch_date'].between(despatch_start, despatch_end)) &
-    (df['order_channel'].isin(selected_channels))
-]
-
-if apply_order_filter:
-    filtered_df = filtered_df[filtered_df['order_date'].between(order_start, order_end)]
-
-if filtered_df.empty:
+if live_mode:
+    try:
+        daily_totals, line_stats = load_live_aggregates(
+            despatch_start, despatch_end,
+            order_start if apply_order_filter else None,
+            order_end if apply_order_filter else None,
+            None if all_channels else tuple(selected_channels)
+        )
+    except Exception as e:
+        st.error(f"❌ Query execution failed: {e}")
+        st.stop()
+    unique_product_skus = int(line_stats.at[0, 'unique_skus'])
+    total_quantity_ordered = int(line_stats.at[0, 'total_qty'] or 0)
+else:
+    # The despatch range is a slice of the date-sorted rollups; the rest filters that slice
+    cutoff = history_start()
+    orders_window = window("order_rollup", despatch_start, despatch_end)
+    sku_window = window("sku_rollup", despatch_start, despatch_end)
+    order_mask = (orders_window['order_date'] >= cutoff) & orders_window['order_channel'].isin(selected_channels)
+    sku_mask = (sku_window['order_date'] >= cutoff) & sku_window['order_channel'].isin(selected_channels)
+
+    if apply_order_filter:
+        order_mask &= orders_window['order_date'].between(order_start, order_end)
+        sku_mask &= sku_window['order_date'].between(order_start, order_end)
+
+    daily_totals = orders_window[order_mask]
+    filtered_skus = sku_window[sku_mask]
+    unique_product_skus = filtered_skus['product_sku'].nunique()
+    total_quantity_ordered = int(filtered_skus['product_qty'].sum())
+
+refresh_button()
+with st.sidebar.expander("🧠 Cached Data Memory"):
+    st.dataframe(memory_report(["overview/live_daily_totals"] if live_mode else ["order_rollup", "sku_rollup"]), hide_index=True)
+
+if daily_totals.empty:
     st.warning("No data available for selected filters.")
     st.stop()
 
 # ------------------ BUSINESS METRICS ------------------
-dedup_orders = filtered_df.drop_duplicates(subset='order_id')
-total_orders = dedup_orders['order_id'].nunique()
-total_revenue = dedup_orders['order_value'].sum()
-avg_order_value = dedup_orders['order_value'].mean()
-unique_product_skus = filtered_df['product_sku'].nunique()
-total_quantity_ordered = filtered_df['product_qty'].sum()
+total_orders = int(daily_totals['orders'].sum())
+total_revenue = daily_totals['order_value'].sum()
+avg_order_value = total_revenue / total_orders if total_orders else 0
 
 col1, col2, col3, col4, col5 = st.columns(5)
 col1.metric("🛒 Total Orders", total_orders)
@@ -157,13 +145,13 @@ col5.metric("📦 Total Quantity Ordered", total_quantity_ordered)
 
 # ------------------ VISUALIZATIONS ------------------
 st.subheader("📈 Revenue Trend Over Time")
-df_line = dedup_orders.groupby('order_date')['order_value'].sum().reset_index()
+df_line = daily_totals.groupby('order_date')['order_value'].sum().reset_index()
 fig_line = px.line(df_line, x='order_date', y='order_value', title="Order Value Over Time")
 st.plotly_chart(fig_line, use_container_width=True)
 
-channel_summary = dedup_orders.groupby('order_channel').agg(
+channel_summary = daily_totals.groupby('order_channel', observed=True).agg(
     total_orders_value=('order_value', 'sum'),
-    orders_count=('order_id', 'nunique')
+    orders_count=('orders', 'sum')
 ).reset_index()
 
 st.subheader("📊 Total Orders Value by Channel")
@@ -1,115 +1,53 @@
 import streamlit as st
 import pandas as pd
-import pyodbc
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
 import plotly.express as px
-import io
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+from utils.datasets import load_batch
+from utils.dateranges import QUICK_RANGES, resolve_range
+from utils.exports import download_file
+from utils.metadata import latest_date
+from utils.queries import channel_summary, daily_channel_summary
+from utils.reports import LAYOUTS, channel_summary_workbook
 
 st.set_page_config(page_title="📦 Channel Despatch Summary", layout="wide")
 st.title("🚚 Daily Despatch Summary")
 
-# ------------------ DB CONNECT ------------------
-def connect_db():
-    try:
-        return pyodbc.connect(
-            "DRIVER={ODBC Driver 17 for SQL Server};"
-            "SERVER=mptcecommerce-sql-server.database.windows.net;"
-            "DATABASE=mptcecommerce-db;"
-            "UID=mptcadmin;"
-            "PWD=Mptc@2025;"
-            "Connection Timeout=30"
-        )
-    except Exception as e:
-        st.error(f"❌ Database connection failed: {e}")
-        return None
-
-# ------------------ DATE FILTER UTILITY ------------------
-def get_range_from_option(option, available_dates):
-    if not available_dates:
-        return None, None
-
-    latest_date = max(available_dates)
-
-    if option == "Yesterday":
-        # Always use the latest available date
-        return latest_date, latest_date
-    elif option == "Last 7 Days":
-        return latest_date - timedelta(days=6), latest_date
-    elif option == "Last 30 Days":
-        return latest_date - timedelta(days=29), latest_date
-    elif option == "Last 3 Months":
-        return latest_date - relativedelta(months=3), latest_date
-    elif option == "Last 6 Months":
-        return latest_date - relativedelta(months=6), latest_date
-    elif option == "Last 12 Months":
-        return latest_date - relativedelta(months=12), latest_date
-    return None, None
-
 # ------------------ DATE FILTER UI ------------------
 st.sidebar.header("📅 Select Despatch Date")
 selected_range = st.sidebar.date_input("Despatch Date Range", [])
-quick_range = st.sidebar.selectbox("🕒 Quick Despatch Range", [
-    "None", "Yesterday", "Last 7 Days", "Last 30 Days", "Last 3 Months", "Last 6 Months", "Last 12 Months"
-])
-
-# TEMP LOAD to get available dates
-@st.cache_data
-def load_temp_dates():
-    conn = connect_db()
-    if conn:
-        df = pd.read_sql("SELECT DISTINCT CAST(despatch_date AS DATE) AS despatch_date FROM OrdersDespatch", conn)
-        conn.close()
-        return sorted(pd.to_datetime(df['despatch_date']).unique())
-    return []
-
-available_dates = load_temp_dates()
-
-if quick_range != "None":
-    start_date, end_date = get_range_from_option(quick_range, available_dates)
-elif len(selected_range) == 1:
-    start_date = end_date = selected_range[0]
-elif len(selected_range) == 2:
-    start_date, end_date = selected_range
-else:
-    end_date = max(available_dates) if available_dates else datetime.today()
-    start_date = end_date - timedelta(days=30)
-
-start_date_str = start_date.strftime("%Y-%m-%d")
-end_date_str = end_date.strftime("%Y-%m-%d")
+quick_range = st.sidebar.selectbox("🕒 Quick Despatch Range", QUICK_RANGES)
 
 # ------------------ LOAD DATA ------------------
 @st.cache_data
 def load_data(start_date_str, end_date_str):
-    query = f"""
-    WITH despatch_data AS (
-        SELECT DISTINCT order_id, order_channel, despatch_date, order_value
-        FROM OrdersDespatch
-        WHERE CAST(despatch_date AS DATE) BETWEEN '{start_date_str}' AND '{end_date_str}'
-    ),
-    channel_total AS (
-        SELECT 
-            order_channel, 
-            SUM(order_value) AS total_orders_value,
-            COUNT(DISTINCT order_id) AS orders_count
-        FROM despatch_data
-        GROUP BY order_channel
-    )
-    SELECT order_channel AS channel, total_orders_value, orders_count
-    FROM channel_total
-    ORDER BY total_orders_value DESC;
-    """
-    conn = connect_db()
-    if conn:
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return df
-    return pd.DataFrame()
-
-df = load_data(start_date_str, end_date_str)
+    return channel_summary(start_date_str, end_date_str)
+
+@st.cache_data
+def load_daily_data(start_date_str, end_date_str):
+    return daily_channel_summary(start_date_str, end_date_str)
+
+def date_strings(start_date, end_date):
+    return start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+
+# The window resolves from the cached MIN/MAX date lookup, so on every path the summary
+# and, for the per-day and per-channel workbooks, its daily breakdown go out as one batch.
+# The layout is read from the widget's state, which is set before the widget is drawn below.
+try:
+    latest = latest_date("OrdersDespatch", "despatch_date")
+except Exception as e:
+    st.error(f"❌ Database connection failed: {e}")
+    st.stop()
+start_date, end_date = resolve_range(quick_range, selected_range, latest, default_days=30)
+start_date_str, end_date_str = date_strings(start_date, end_date)
+
+jobs = {"summary": lambda: load_data(start_date_str, end_date_str)}
+if st.session_state.get("workbook_layout", LAYOUTS[0]) != LAYOUTS[0]:
+    jobs["daily"] = lambda: load_daily_data(start_date_str, end_date_str)
+
+try:
+    df = load_batch(jobs)["summary"]
+except Exception as e:
+    st.error(f"❌ Query failed: {e}")
+    df = pd.DataFrame()
 
 if df.empty:
     st.warning("No orders found.")
@@ -120,33 +58,23 @@ grand_total_value = df["total_orders_value"].sum()
 grand_total_count = df["orders_count"].sum()
 df.loc[len(df.index)] = ["Grand Total", grand_total_value, grand_total_count]
 
-output = io.BytesIO()
-wb = Workbook()
-ws = wb.active
-ws.title = "Channel Summary"
-ws["A1"] = "Selected Despatch Date:"
-ws["B1"] = f"{start_date.strftime('%d-%m-%Y')} to {end_date.strftime('%d-%m-%Y')}"
-ws["A2"] = "Day:"
-ws["B2"] = start_date.strftime("%A") if start_date == end_date else "Multiple Days"
-ws["A1"].font = ws["A2"].font = Font(bold=True)
-
-for r_idx, row in enumerate(dataframe_to_rows(df, index=False, header=True), 4):
-    for c_idx, value in enumerate(row, 1):
-        cell = ws.cell(row=r_idx, column=c_idx, value=value)
-        if r_idx == 4 or row[0] == "Grand Total":
-            cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-ws.column_dimensions["A"].width = 30
-ws.column_dimensions["B"].width = 20
-ws.column_dimensions["C"].width = 15
-wb.save(output)
-output.seek(0)
+# Built only when requested, with one sheet per day or channel on demand, and cached
+# per date range, layout and summary contents
+layout = st.selectbox("🗂️ Workbook Layout", LAYOUTS, key="workbook_layout")
+
+def build_workbook():
+    daily = load_daily_data(start_date_str, end_date_str) if layout != LAYOUTS[0] else None
+    return channel_summary_workbook(df, start_date, end_date, daily=daily, layout=layout)
 
 # ------------------ DISPLAY ------------------
 st.subheader(f"📋 Channel Summary from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-st.download_button("📅 Download Excel", data=output, file_name=f"Channel_Summary_{start_date_str}_to_{end_date_str}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+download_file(
+    build_workbook,
+    f"Channel_Summary_{start_date_str}_to_{end_date_str}.xlsx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    fingerprint=(start_date_str, end_date_str, layout, int(pd.util.hash_pandas_object(df).sum())),
+    label="📅 Download Excel"
+)
 st.dataframe(df, use_container_width=True)
 
 # ------------------ CHARTS ------------------
@@ -1,107 +1,76 @@
 import streamlit as st
 import pandas as pd
-import pyodbc
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from datetime import timedelta
+from utils.db import run_query
+from utils.datasets import refresh_button, window
+from utils.dateranges import QUICK_RANGES, resolve_range
+from utils.exports import download
+from utils.frames import compact, memory_report
+from utils.metadata import latest_date
+from utils.queries import ORDER_LINE_DTYPES
+from utils.rollups import history_start
 
 st.set_page_config(page_title="📋 Channel-wise Detailed Report", layout="wide")
 st.title("🧾 Channel-wise Detailed Analytics")
 
-# ------------------ DATABASE CONNECTION ------------------
-def connect_db():
-    try:
-        return pyodbc.connect(
-            "DRIVER={ODBC Driver 17 for SQL Server};"
-            "SERVER=mptcecommerce-sql-server.database.windows.net;"
-            "DATABASE=mptcecommerce-db;"
-            "UID=mptcadmin;"
-            "PWD=Mptc@2025;"
-            "Connection Timeout=30"
-        )
-    except Exception as e:
-        st.error(f"❌ Database connection failed: {e}")
-        return None
-
 # ------------------ LOAD DATA FUNCTION ------------------
-@st.cache_data
-def load_data():
-    conn = connect_db()
-    if conn is None:
-        return pd.DataFrame()
+# Daily rollups replace the 12-month raw pull; raw lines are only fetched on request below.
+# The rollups are the shared datasets also used by the overview page, held sorted by
+# despatch_date, so each date filter below is a window slice rather than a column scan.
+ROLLUP_TABLES = ("order_rollup", "sku_rollup", "postcode_rollup")
+
+def load_window(start_date=None, end_date=None):
     try:
-        query = """
-        SELECT order_id, order_channel, order_value, order_cust_postcode, product_sku, 
-               product_name, product_qty, product_price, despatch_date
-        FROM OrdersDespatch
-        WHERE despatch_date >= DATEADD(MONTH, -12, GETDATE())
-        """
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return df
+        cutoff = history_start()
+        start_date = cutoff if start_date is None else max(pd.Timestamp(start_date), cutoff)
+        return {table: window(table, start_date, end_date) for table in ROLLUP_TABLES}
     except Exception as e:
         st.error(f"❌ Query failed: {e}")
-        return pd.DataFrame()
-
-df = load_data()
-if df.empty:
+        return {}
+
+# Raw line-level frames are large, so only a few recent date ranges are kept
+@st.cache_data(ttl=600, max_entries=8)
+def load_raw_lines(start_date, end_date, channels):
+    query = f"""
+    SELECT order_id, order_channel, order_value, order_cust_postcode, product_sku, 
+           product_name, product_qty, product_price, despatch_date
+    FROM OrdersDespatch
+    WHERE despatch_date >= ? AND despatch_date < ?
+      AND order_channel IN ({', '.join('?' * len(channels))})
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date) + timedelta(days=1)
+    params = [start.to_pydatetime(), end.to_pydatetime(), *channels]
+    return compact(run_query(query, params, dtypes=ORDER_LINE_DTYPES), label="detailed/raw_lines")
+
+rollups = load_window()
+if not rollups or rollups["order_rollup"].empty:
     st.stop()
 
-df['despatch_date'] = pd.to_datetime(df['despatch_date'])
-
 # ------------------ SIDEBAR: DESPATCH DATE FILTERS ------------------
+refresh_button()
+with st.sidebar.expander("🧠 Cached Data Memory"):
+    st.dataframe(memory_report(["order_rollup", "sku_rollup", "postcode_rollup", "detailed/raw_lines"]), hide_index=True)
+
 st.sidebar.header("📅 Filter by Despatch Date")
 
 # Manual + quick filters
 selected_range = st.sidebar.date_input("Despatch Date Range", [])
-quick_range = st.sidebar.selectbox("🕒 Quick Despatch Range", [
-    "None", "Yesterday", "Last 7 Days", "Last 30 Days", "Last 3 Months", "Last 6 Months", "Last 12 Months"
-])
-
-# Function to compute date ranges from dropdown option
-def get_range_from_option(option, df_date_col):
-    if df_date_col.empty:
-        return None, None
-
-    all_dates = sorted(df_date_col.dt.normalize().dropna().unique())
-    latest_date = max(all_dates)
-
-    if option == "Yesterday":
-        # Use the latest date that has data
-        return latest_date, latest_date
-    elif option == "Last 7 Days":
-        return latest_date - timedelta(days=6), latest_date
-    elif option == "Last 30 Days":
-        return latest_date - timedelta(days=29), latest_date
-    elif option == "Last 3 Months":
-        return latest_date - relativedelta(months=3), latest_date
-    elif option == "Last 6 Months":
-        return latest_date - relativedelta(months=6), latest_date
-    elif option == "Last 12 Months":
-        return latest_date - relativedelta(months=12), latest_date
-    else:
-        return None, None
+quick_range = st.sidebar.selectbox("🕒 Quick Despatch Range", QUICK_RANGES)
 
-# Determine final start_date and end_date
-if quick_range != "None":
-    start_date, end_date = get_range_from_option(quick_range, df['despatch_date'])
-elif len(selected_range) == 1:
-    start_date = end_date = pd.to_datetime(selected_range[0])
-elif len(selected_range) == 2:
-    start_date, end_date = pd.to_datetime(selected_range)
-else:
-    end_date = df['despatch_date'].max().normalize()
-    start_date = end_date - timedelta(days=30)
+# Latest despatch day from the rollup store's cached MIN/MAX, not a sort of the column
+latest_despatch = latest_date("order_rollup", "despatch_date")
 
-# Normalize despatch_date
-df['despatch_date'] = pd.to_datetime(df['despatch_date']).dt.normalize()
+# Determine final start_date and end_date
+start_date, end_date = resolve_range(quick_range, selected_range, latest_despatch, default_days=30)
 
 # Apply date filter
 st.caption(f"Debug: Filtering from {start_date.date()} to {end_date.date()}")
-st.caption(f"Max despatch date in data: {df['despatch_date'].max().date()}")
-filtered_df = df[df['despatch_date'].between(start_date, end_date)]
+st.caption(f"Max despatch date in data: {latest_despatch.date()}")
+rollups = load_window(start_date, end_date)
+filtered_orders = rollups["order_rollup"]
 
 # ------------------ CHANNEL FILTER ------------------
-channels = sorted(filtered_df['order_channel'].dropna().unique().tolist())
+channels = sorted(filtered_orders['order_channel'].dropna().unique().tolist())
 all_option = "Select All"
 channels_with_all = [all_option] + channels
 
@@ -112,10 +81,12 @@ if all_option in selected_channels or not selected_channels:
     selected_channels = channels
 
 # Final filter by channel
-filtered_df = filtered_df[filtered_df['order_channel'].isin(selected_channels)]
+filtered_orders = filtered_orders[filtered_orders['order_channel'].isin(selected_channels)]
+filtered_skus = rollups["sku_rollup"][rollups["sku_rollup"]['order_channel'].isin(selected_channels)]
+filtered_postcodes = rollups["postcode_rollup"][rollups["postcode_rollup"]['order_channel'].isin(selected_channels)]
 
 # Exit early if empty
-if filtered_df.empty:
+if filtered_orders.empty:
     st.warning("No data for selected filters.")
     st.stop()
 
@@ -123,11 +94,10 @@ if filtered_df.empty:
 top_n = st.selectbox("Show Top/Bottom N Records", [5, 10, 15, 20, 25], index=1)
 
 # ------------------ KPIs ------------------
-dedup_orders = filtered_df.drop_duplicates(subset='order_id')
-total_orders = dedup_orders['order_id'].nunique()
-total_revenue = dedup_orders['order_value'].sum()
-avg_order_value = dedup_orders['order_value'].mean()
-unique_skus = filtered_df['product_sku'].nunique()
+total_orders = int(filtered_orders['orders'].sum())
+total_revenue = filtered_orders['order_value'].sum()
+avg_order_value = total_revenue / total_orders if total_orders else 0
+unique_skus = filtered_skus['product_sku'].nunique()
 
 col1, col2, col3, col4 = st.columns(4)
 col1.metric("🛒 Total Orders", total_orders)
@@ -137,10 +107,10 @@ col4.metric("🔢 Unique SKUs Sold", unique_skus)
 
 # ------------------ SKU SUMMARY ------------------
 sku_summary = (
-    filtered_df.groupby(['product_sku', 'product_name'])
+    filtered_skus.groupby(['product_sku', 'product_name'], observed=True)
     .agg(
         sold_qty=('product_qty', 'sum'),
-        unique_orders=('order_id', pd.Series.nunique)
+        unique_orders=('orders', 'sum')
     )
     .reset_index()
 )
@@ -160,7 +130,11 @@ st.dataframe(
 )
 
 # ------------------ POSTCODE STATS ------------------
-postcode_summary = filtered_df['order_cust_postcode'].value_counts().reset_index()
+postcode_summary = (
+    filtered_postcodes.groupby('order_cust_postcode', observed=True)['order_lines'].sum()
+    .sort_values(ascending=False)
+    .reset_index()
+)
 postcode_summary.columns = ['Postcode', 'Orders']
 
 if not postcode_summary.empty:
@@ -174,12 +148,17 @@ else:
 
 # ------------------ RAW DATA + DOWNLOAD ------------------
 st.markdown("### 🧾 Sample Raw Data")
-st.dataframe(filtered_df.head(10), use_container_width=True)
-
-csv_data = filtered_df.to_csv(index=False).encode("utf-8")
-st.download_button(
-    label="⬇️ Download Full Filtered Channel Data as CSV",
-    data=csv_data,
-    file_name=f"filtered_channel_orders.csv",
-    mime="text/csv"
-)
+if st.toggle("Load raw order lines for the selected range"):
+    try:
+        filtered_df = load_raw_lines(start_date, end_date, tuple(selected_channels))
+    except Exception as e:
+        st.error(f"❌ Query failed: {e}")
+        st.stop()
+
+    st.dataframe(filtered_df.head(10), use_container_width=True)
+
+    download(
+        filtered_df, "filtered_channel_orders",
+        fingerprint=(start_date, end_date, tuple(selected_channels)),
+        label="⬇️ Download Full Filtered Channel Data"
+    )
@@ -1,83 +1,109 @@
 import streamlit as st
 import pandas as pd
-import pyodbc
-from utils.db import connect_db
+from utils.datasets import refresh_button, snapshot
+from utils.exports import download
+from utils.facets import FacetIndex
+from utils.frames import apply_mask, memory_report
+from utils.queries import product_rows
+from utils.timing import RerunTimer
 
 st.set_page_config(page_title="All Products", layout="wide")
 st.title("📦 Products Information Portal")
+timer = RerunTimer()
+
+# Lazy mode keeps only the narrow facet columns in memory and fetches full rows, long
+# text included, one page of SKUs at a time. It is opt-in: the long text columns are not
+# loaded, so their filters are not available in it.
+lazy_mode = st.sidebar.toggle(
+    "📄 Lazy catalogue (paged)", value=False,
+    help="Loads less and pages the results; the Description, Composition and Customs Description filters are not available"
+)
+
+dataset = "product_facets" if lazy_mode else "products"
 
-@st.cache_data
 def load_data():
-    conn = connect_db()
-    query = "SELECT * FROM Products"
-    return pd.read_sql(query, conn)
+    # The facet index below is taken from the same snapshot as the frame
+    catalogue = snapshot(dataset)
+    return catalogue, catalogue.view()
+
+@st.cache_data(ttl=600)
+def load_product_page(skus):
+    return product_rows(skus)
 
-df = load_data()
+with timer.section("load"):
+    catalogue, df = load_data()
+
+refresh_button()
+with st.sidebar.expander("🧠 Cached Data Memory"):
+    st.dataframe(memory_report([dataset]), hide_index=True)
 
 st.markdown("### 🔍 Filter Products")
 
-temp_df = df.copy()
-
-col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    skus = st.multiselect("Product SKU", sorted(temp_df['product_sku'].dropna().unique()))
-with col2:
-    categories = st.multiselect("Category", sorted(temp_df['product_category'].dropna().unique()))
-with col3:
-    names = st.multiselect("Product Name", sorted(temp_df['product_name'].dropna().unique()))
-with col4:
-    descriptions = st.multiselect("Description", sorted(temp_df['product_description'].dropna().unique()))
-
-filters = {
-    "product_sku": skus,
-    "product_category": categories,
-    "product_name": names,
-    "product_description": descriptions
-}
-
-for col, values in filters.items():
-    if values:
-        temp_df = temp_df[temp_df[col].isin(values)]
-
-col5, col6, col7, col8 = st.columns(4)
-
-with col5:
-    countries = st.multiselect("Source Country", sorted(temp_df['product_source_country'].dropna().unique()))
-with col6:
-    commodity_codes = st.multiselect("Commodity Code", sorted(temp_df['product_commodity_code'].dropna().unique()))
-with col7:
-    ean = st.multiselect("EAN Barcode", sorted(temp_df['ean_barcode'].dropna().unique()))
-with col8:
-    composition = st.multiselect("Product Composition", sorted(temp_df['product_composition'].dropna().unique()))
-
-with col5:
-    brand = st.multiselect("Brand Name", sorted(temp_df['brand_name'].dropna().unique()))
-with col6:
-    customs = st.multiselect("Customs Description", sorted(temp_df['customs_description'].dropna().unique()))
-
-extra_filters = {
-    "product_source_country": countries,
-    "product_commodity_code": commodity_codes,
-    "ean_barcode": ean,
-    "product_composition": composition,
-    "brand_name": brand,
-    "customs_description": customs
-}
-
-for col, values in extra_filters.items():
-    if values:
-        temp_df = temp_df[temp_df[col].isin(values)]
+FACETS = [
+    ("Product SKU", "product_sku"),
+    ("Category", "product_category"),
+    ("Product Name", "product_name"),
+    ("Description", "product_description"),
+    ("Source Country", "product_source_country"),
+    ("Commodity Code", "product_commodity_code"),
+    ("EAN Barcode", "ean_barcode"),
+    ("Product Composition", "product_composition"),
+    ("Brand Name", "brand_name"),
+    ("Customs Description", "customs_description"),
+]
+# Long text columns are not loaded in lazy mode, so they are not offered as filters
+facets = [(label, col) for label, col in FACETS if col in df.columns]
+
+def build_facet_index(frame):
+    return FacetIndex(frame, [col for _, col in FACETS if col in frame.columns])
+
+# Value -> row bitmaps built once per catalogue load; selections come from the widget
+# state, so every facet's options and counts reflect the other facets' filters
+with timer.section("facets"):
+    index = catalogue.derived("facets", build_facet_index)
+    selections = {col: st.session_state.get(f"facet_{col}", []) for _, col in facets}
+    facet_options = index.options(selections)
+
+filter_cols = st.columns(4)
+for i, (label, col) in enumerate(facets):
+    counts = facet_options[col]
+    # Selected values stay listed even when the other facets leave them no rows
+    options = list(counts) + [value for value in selections[col] if value not in counts]
+    with filter_cols[i % 4]:
+        st.multiselect(
+            label, options, key=f"facet_{col}",
+            format_func=lambda value, counts=counts: f"{value} ({counts.get(value, 0):,})"
+        )
+
+with timer.section("filter"):
+    temp_df = apply_mask(df, pd.Series(index.mask(selections), index=df.index))
+
+export_fingerprint = (dataset, catalogue.loaded_at, sorted((col, list(values)) for col, values in selections.items()))
 
 if temp_df.empty:
     st.warning("No records match your filters.")
+elif lazy_mode:
+    keys = sorted(temp_df['product_sku'].dropna().unique())
+    info_col, size_col, page_col = st.columns([0.6, 0.2, 0.2])
+    with size_col:
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 200], index=1)
+    page_count = max(1, -(-len(keys) // page_size))
+    with page_col:
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1)
+    with info_col:
+        st.caption(f"{len(keys):,} products · page {page} of {page_count}")
+
+    # Pages are slices of the filtered key list; product_rows() fetches one slice by key
+    with timer.section("page fetch"):
+        page_df = load_product_page(tuple(keys[(page - 1) * page_size:page * page_size]))
+    st.dataframe(page_df)
+
+    # Full rows for every filtered product are only pulled when the file is prepared
+    download(lambda: product_rows(keys), "filtered_products", fingerprint=export_fingerprint,
+             label="⬇️ Download Filtered Products")
 else:
-    st.dataframe(temp_df)
-
-    csv = temp_df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="⬇️ Download Filtered Products CSV",
-        data=csv,
-        file_name="filtered_products.csv",
-        mime="text/csv"
-    )
+    with timer.section("render"):
+        st.dataframe(temp_df)
+
+        download(temp_df, "filtered_products", fingerprint=export_fingerprint,
+                 label="⬇️ Download Filtered Products")
@@ -1,6 +1,7 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
+from utils.reconcile import delta_report
+from utils.uploads import read_upload, upload_columns
 
 st.set_page_config(page_title="📊 Routine Reports", layout="wide")
 st.title("📊 Routine Reports Suite")
@@ -13,13 +14,17 @@ with tab1:
     uploaded_file = st.file_uploader("Upload Channel-wise Invoice file", type=["xlsx", "csv"])
 
     if uploaded_file:
-        if uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file)
-        else:
-            df = pd.read_csv(uploaded_file)
+        # ✅ Read only the channel column and the columns the summary needs
+        headers = upload_columns(uploaded_file)
+        clean = {col: str(col).strip().lower().replace(" ", "_") for col in headers}
+        wanted = {headers[0]: "str", **{
+            col: ("str" if name == "product_sku" else "number")
+            for col, name in clean.items() if name in ("product_sku", "product_qty", "order_value")
+        }}
+        df = read_upload(uploaded_file, list(wanted), dtypes=wanted)
 
         # ✅ FIX: Clean column names
-        df.columns = [col.strip().lower().replace(" ", "_") for col in df.columns]
+        df.columns = [clean[col] for col in df.columns]
 
         st.dataframe(df.head())
         channel_col = df.columns[0]
@@ -55,29 +60,33 @@ with tab2:
 
     if opera_file and mintsoft_file:
         try:
-            # ✅ Read Opera file with header row
-            opera_df = pd.read_excel(opera_file, header=0)
+            # ✅ Read Opera header row, then only the two columns the report needs
+            opera_columns = upload_columns(opera_file)
 
             # ✅ Normalize Opera column names
-            opera_df.columns = [col.strip().lower().replace("  ", " ").replace("_", " ") for col in opera_df.columns]
+            normalized = {col: str(col).strip().lower().replace("  ", " ").replace("_", " ") for col in opera_columns}
 
             # ✅ Fuzzy match for Opera columns
-            sku_col = next((col for col in opera_df.columns if "stock reference" in col), None)
-            stock_col = next((col for col in opera_df.columns if "free stock quantity" in col), None)
+            sku_col = next((col for col, name in normalized.items() if "stock reference" in name), None)
+            stock_col = next((col for col, name in normalized.items() if "free stock quantity" in name), None)
 
             if not sku_col or not stock_col:
                 st.error("❌ 'Opera Stock' file must contain columns like 'Stock Reference' and 'Free Stock Quantity'")
-                st.write("🔍 Detected columns:", opera_df.columns.tolist())
+                st.write("🔍 Detected columns:", list(normalized.values()))
                 st.stop()
 
             # ✅ Standardize column names
-            opera_df = opera_df[[sku_col, stock_col]].rename(
+            opera_df = read_upload(opera_file, [sku_col, stock_col], dtypes={sku_col: "str", stock_col: "number"}).rename(
                 columns={sku_col: 'SKU', stock_col: 'Opera_Stock'}
             )
 
             # ✅ Read and clean Mintsoft file
-            mintsoft_df = pd.read_excel(mintsoft_file)
-            mintsoft_df = mintsoft_df[['ProductSKU', 'Location', 'Quantity']].rename(
+            mintsoft_columns = ['ProductSKU', 'Location', 'Quantity']
+            missing = [col for col in mintsoft_columns if col not in upload_columns(mintsoft_file)]
+            if missing:
+                st.error(f"❌ 'Mintsoft Export' file is missing columns: {', '.join(missing)}")
+                st.stop()
+            mintsoft_df = read_upload(mintsoft_file, mintsoft_columns, dtypes={'ProductSKU': "str", 'Quantity': "number"}).rename(
                 columns={'ProductSKU': 'SKU', 'Quantity': 'Mintsoft_Quantity'}
             )
 
@@ -86,60 +95,8 @@ with tab2:
             mintsoft_df['SKU'] = mintsoft_df['SKU'].astype(str)
             opera_df['Opera_Stock'] = opera_df['Opera_Stock'].apply(lambda x: max(x, 0))
 
-            # ✅ Group Mintsoft total stock
-            mintsoft_total = mintsoft_df.groupby('SKU')['Mintsoft_Quantity'].sum().reset_index()
-            mintsoft_total.rename(columns={'Mintsoft_Quantity': 'Total_Mintsoft_Stock'}, inplace=True)
-
-            # ✅ Merge & calculate delta
-            delta_df = opera_df.merge(mintsoft_total, on='SKU', how='inner')
-            delta_df['Delta_Stock'] = delta_df['Opera_Stock'] - delta_df['Total_Mintsoft_Stock']
-
-            final_report_list = []
-
-            for _, row in delta_df.iterrows():
-                sku = row['SKU']
-                delta_stock = row['Delta_Stock']
-                mintsoft_locations = mintsoft_df[mintsoft_df['SKU'] == sku]
-
-                if delta_stock > 0:
-                    for _, loc_row in mintsoft_locations.iterrows():
-                        final_report_list.append({
-                            'Client': 'MPTC',
-                            'SKU': sku,
-                            'Warehouse': 'Main',
-                            'Location': loc_row['Location'],
-                            'BestBefore': '',
-                            'BatchNo': '',
-                            'SerialNo': '',
-                            'Quantity': delta_stock,
-                            'Comment': 'Quantity added to inventory'
-                        })
-                        break
-
-                elif delta_stock < 0:
-                    remaining_delta = abs(delta_stock)
-                    mintsoft_locations = mintsoft_locations.sort_values(by=['Mintsoft_Quantity', 'Location'])
-                    for _, loc_row in mintsoft_locations.iterrows():
-                        if remaining_delta <= 0:
-                            break
-                        loc_quantity = loc_row['Mintsoft_Quantity']
-                        reduce_quantity = min(loc_quantity, remaining_delta)
-                        remaining_delta -= reduce_quantity
-                        final_report_list.append({
-                            'Client': 'MPTC',
-                            'SKU': sku,
-                            'Warehouse': 'Main',
-                            'Location': loc_row['Location'],
-                            'BestBefore': '',
-                            'BatchNo': '',
-                            'SerialNo': '',
-                            'Quantity': -reduce_quantity,
-                            'Comment': 'Quantity removed from inventory'
-                        })
-
-            # ✅ Final delta report
-            final_report = pd.DataFrame(final_report_list)
-            final_report = final_report[final_report['Quantity'] != 0]
+            # ✅ Allocate each SKU's delta across its Mintsoft locations
+            final_report = delta_report(opera_df, mintsoft_df)
 
             st.subheader("📌 Final Delta Report Preview")
             st.dataframe(final_report, use_container_width=True)
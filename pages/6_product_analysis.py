@@ -1,57 +1,47 @@
 import streamlit as st
 import pandas as pd
-import pyodbc
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
+from utils.datasets import refresh_button, snapshot
+from utils.deadstock import BUCKET_ORDER, dead_stock_table, sku_categories
+from utils.exports import download
+from utils.frames import apply_mask, memory_report
+from utils.search import ProductSearchIndex
+from utils.timing import RerunTimer
 
 st.set_page_config(page_title="📊 Product Sales Analysis", layout="wide")
 st.title("📦 Product Sales History & Dead Stock")
+timer = RerunTimer()
 
-# ------------------ DB CONNECTION ------------------
-def connect_db():
+# ------------------ LOAD DATA ------------------
+def load_data():
+    # Projection of the shared order-lines dataset (local Parquet store, synced by delta)
+    columns = [
+        'order_id',
+        'product_sku',
+        'product_name',
+        'product_category',
+        'order_channel',
+        'order_date',
+        'product_qty',
+        'product_price',
+        'sale_amount'
+    ]
+    # The snapshot is kept too: the search index below must come from the same load
     try:
-        return pyodbc.connect(
-            "DRIVER={ODBC Driver 17 for SQL Server};"
-            "SERVER=mptcecommerce-sql-server.database.windows.net;"
-            "DATABASE=mptcecommerce-db;"
-            "UID=mptcadmin;"
-            "PWD=Mptc@2025;"
-            "Connection Timeout=30"
-        )
+        lines = snapshot("order_lines")
+        return lines, lines.view(columns)
     except Exception as e:
-        st.error(f"❌ Database connection failed: {e}")
-        return None
+        st.error(f"❌ Query failed: {e}")
+        return None, pd.DataFrame()
 
-# ------------------ LOAD DATA ------------------
-@st.cache_data
-def load_data():
-    conn = connect_db()
-    if conn is None:
-        return pd.DataFrame()
-    query = """
-    SELECT 
-        od.order_id,
-        od.product_sku,
-        od.product_name,
-        p.product_category,
-        od.order_channel,
-        od.order_date,
-        od.product_qty,
-        od.product_price
-    FROM OrdersDespatch od
-    LEFT JOIN Products p ON od.product_sku = p.product_sku
-    WHERE od.order_date >= '2023-06-01'
-    """
-    df = pd.read_sql(query, conn)
-    conn.close()
-    df['order_date'] = pd.to_datetime(df['order_date'])
-    df['sale_amount'] = df['product_qty'] * df['product_price']
-    return df
-
-df = load_data()
+with timer.section("load"):
+    lines, df = load_data()
 if df.empty:
     st.stop()
 
+refresh_button()
+with st.sidebar.expander("🧠 Cached Data Memory"):
+    st.dataframe(memory_report(["order_lines", "last_sale"]), hide_index=True)
+
 # ------------------ SIDEBAR DATE FILTER ------------------
 st.sidebar.header("📅 Order Date Filter")
 all_dates = df['order_date'].dt.normalize().dropna().unique()
@@ -81,31 +71,22 @@ with tab1:
     name_terms = [term.strip().lower() for term in name_input.split(',') if term.strip()]
     cat_terms = [term.strip().lower() for term in cat_input.split(',') if term.strip()]
 
-    filtered_df = df.copy()
-
-    if sku_terms:
-        sku_mask = pd.Series(False, index=filtered_df.index)
-        for term in sku_terms:
-            sku_mask |= filtered_df['product_sku'].astype(str).str.lower().str.contains(term)
-        filtered_df = filtered_df[sku_mask]
-
-    if name_terms:
-        name_mask = pd.Series(False, index=filtered_df.index)
-        for term in name_terms:
-            name_mask |= filtered_df['product_name'].astype(str).str.lower().str.contains(term)
-        filtered_df = filtered_df[name_mask]
-
-    if cat_terms:
-        cat_mask = pd.Series(False, index=filtered_df.index)
-        for term in cat_terms:
-            cat_mask |= filtered_df['product_category'].astype(str).str.lower().str.contains(term)
-        filtered_df = filtered_df[cat_mask]
+    # Every filter ANDs into one mask over the shared frame; rows are materialised once
+    with timer.section("filter"):
+        # Terms resolve to product keys through the search index built once per data load
+        search = lines.derived("search", ProductSearchIndex)
+        mask = pd.Series(search.mask({
+            'product_sku': sku_terms,
+            'product_name': name_terms,
+            'product_category': cat_terms,
+        }), index=df.index)
 
-    # ------------------ 2. Apply Date Filter ------------------
-    start_date = pd.to_datetime(selected_date_range[0])
-    end_date = pd.to_datetime(selected_date_range[1])
+        # ------------------ 2. Apply Date Filter ------------------
+        start_date = pd.to_datetime(selected_date_range[0])
+        end_date = pd.to_datetime(selected_date_range[1])
 
-    filtered_df = filtered_df[filtered_df['order_date'].between(start_date, end_date)]
+        mask &= df['order_date'].between(start_date, end_date)
+        filtered_df = apply_mask(df, mask)
 
     if filtered_df.empty:
         st.warning("No data available for selected filters.")
@@ -143,12 +124,9 @@ with tab1:
     with row_col1:
         st.markdown("### 📃 Filtered Sales Data")
     with row_col2:
-        csv_data = filtered_df.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            "⬇️ Download CSV",
-            csv_data,
-            file_name="filtered_sales.csv",
-            mime="text/csv",
+        download(
+            filtered_df, "filtered_sales",
+            fingerprint=(lines.loaded_at, sku_terms, name_terms, cat_terms, start_date, end_date),
             use_container_width=True
         )
     
@@ -157,7 +135,7 @@ with tab1:
      # ------------------ 4. Channel-wise Summary ------------------
     st.markdown("### 📊 Channel-wise Sales Summary")
     channel_summary = (
-        filtered_df.groupby('order_channel')
+        filtered_df.groupby('order_channel', observed=True)
         .agg(
             total_orders=('order_id', pd.Series.nunique),
             total_qty=('product_qty', 'sum'),
@@ -172,48 +150,20 @@ with tab1:
 with tab2:
     st.subheader("🧊 Dead or Unsold Stock")
 
-    from dateutil.relativedelta import relativedelta
     import plotly.express as px
 
-    # Get last sold date per product
-    last_sold = df.groupby(['product_sku', 'product_name'])['order_date'].max().reset_index()
-    last_sold['Days Since Last Sale'] = (pd.Timestamp.now().normalize() - last_sold['order_date']).dt.days
-    last_sold['Last Sold'] = last_sold['order_date'].dt.strftime('%Y-%m-%d')
-
-    # Human-readable "Time Since Last Sale"
-    def time_since(date):
-        delta = relativedelta(datetime.now().date(), date)
-        parts = []
-        if delta.years: parts.append(f"{delta.years} yr{'s' if delta.years > 1 else ''}")
-        if delta.months: parts.append(f"{delta.months} mo")
-        if delta.days: parts.append(f"{delta.days} d")
-        return " ".join(parts) if parts else "Today"
-
-    last_sold['Time Since Last Sale'] = pd.to_datetime(last_sold['order_date']).dt.date.apply(time_since)
-
-    # Define ranges for unsold buckets (fixed display order)
-    unsold_buckets = {
-        "7 days to 1 month": (7, 30),
-        "1 to 3 months": (31, 90),
-        "3 to 6 months": (91, 180),
-        "6 months to 1 year": (181, 365),
-        "more than 1 year": (366, float("inf"))
-    }
-
-    # Assign each SKU to one bucket
-    def assign_bucket(days):
-        for bucket, (min_d, max_d) in unsold_buckets.items():
-            if min_d <= days <= max_d:
-                return bucket
-        return None
-
-    last_sold['Bucket'] = last_sold['Days Since Last Sale'].apply(assign_bucket)
+    # Last sale per product from the store's incremental index; the bucketed table is
+    # built once per day and index load, separately from the Sales History tab
+    today = pd.Timestamp.now().normalize()
+    with timer.section("dead stock"):
+        last_sales = snapshot("last_sale")
+        last_sold = last_sales.derived(("dead_stock", today), lambda frame: dead_stock_table(frame, today))
 
     # ------------------ 1. Summary KPI for ALL Buckets ------------------
     st.markdown("### 📦 Unique SKU Count Unsold by Time Bucket")
-    bucket_order = list(unsold_buckets.keys())
+    bucket_order = BUCKET_ORDER
     bucket_counts = (
-        last_sold.groupby('Bucket')['product_sku'].nunique()
+        last_sold.groupby('Bucket', observed=False)['product_sku'].nunique()
         .reindex(bucket_order)
         .reset_index()
         .fillna(0)
@@ -245,8 +195,11 @@ with tab2:
             with row1_col1:
                 st.markdown("### 🧾 Dead Stock List")
             with row1_col2:
-                csv_dead = dead_stock_sorted.to_csv(index=False).encode("utf-8")
-                st.download_button("⬇️ Download CSV", csv_dead, file_name="dead_stock.csv", mime="text/csv", use_container_width=True)
+                download(
+                    dead_stock_sorted, "dead_stock",
+                    fingerprint=(last_sales.loaded_at, today, sorted(selected_buckets)),
+                    use_container_width=True
+                )
 
             st.dataframe(
                 dead_stock_sorted[['product_sku', 'product_name', 'Bucket', 'Last Sold', 'Days Since Last Sale', 'Time Since Last Sale']],
@@ -277,13 +230,7 @@ with tab2:
         points="all",
         title="📦 Days Since Last Sale Distribution by Time Bucket",
         color="Bucket",
-        category_orders={"Bucket": [
-            "7 days to 1 month",
-            "1 to 3 months",
-            "3 to 6 months",
-            "6 months to 1 year",
-            "more than 1 year"
-        ]}
+        category_orders={"Bucket": BUCKET_ORDER}
     )
 
     box_fig.update_layout(height=700)
@@ -296,13 +243,12 @@ with tab2:
     st.markdown("### 🧯 Unsold SKU Count by Product Category")
 
     # Join categories
-    df_with_category = df.dropna(subset=['product_category'])
-    sku_category_map = df_with_category[['product_sku', 'product_category']].drop_duplicates()
+    sku_category_map = lines.derived("sku_categories", sku_categories)
     dead_skus = pd.merge(last_sold.dropna(subset=['Bucket']), sku_category_map, on='product_sku', how='left')
 
     # Count by category
     category_counts = (
-        dead_skus.groupby('product_category')['product_sku']
+        dead_skus.groupby('product_category', observed=True)['product_sku']
         .nunique()
         .reset_index()
         .rename(columns={'product_sku': 'Unsold SKU Count'})
@@ -1,56 +1,63 @@
 # 7_inventory_analytics.py
 import streamlit as st
 import pandas as pd
-import pyodbc
-from datetime import datetime, timedelta
-from forecasting_model import forecast_multiple_skus, prepare_forecast_csv
+from utils.datasets import refresh_button, snapshot
+from utils.exports import download
+from utils.frames import apply_mask, memory_report
+from utils.search import ProductSearchIndex
+from utils.timing import RerunTimer
+from forecasting_model import (
+    ForecastCache, NumpyForecaster, ProphetForecaster, VolumeRouter,
+    build_demand_matrix, forecast_multiple_skus
+)
 
 st.set_page_config(page_title="📈 Inventory Forecast & Planning", layout="wide")
 st.title("🗃️ Inventory Forecast & Recommendation")
+timer = RerunTimer()
 
-# ------------------ DB CONNECTION ------------------
-def connect_db():
+# ------------------ LOAD DATA ------------------
+def load_data():
+    # Projection of the shared order-lines dataset; order timestamps are bucketed to
+    # their day by the demand matrix
+    columns = [
+        'order_id',
+        'product_sku',
+        'product_name',
+        'product_category',
+        'order_date',
+        'product_qty'
+    ]
+    # The snapshot is kept too: the search index below must come from the same load
     try:
-        return pyodbc.connect(
-            "DRIVER={ODBC Driver 17 for SQL Server};"
-            "SERVER=mptcecommerce-sql-server.database.windows.net;"
-            "DATABASE=mptcecommerce-db;"
-            "UID=mptcadmin;"
-            "PWD=Mptc@2025;"
-            "Connection Timeout=30"
-        )
+        lines = snapshot("order_lines")
+        return lines, lines.view(columns)
     except Exception as e:
-        st.error(f"❌ Database connection failed: {e}")
-        return None
+        st.error(f"❌ Query failed: {e}")
+        return None, pd.DataFrame()
 
-# ------------------ LOAD DATA ------------------
-@st.cache_data
-def load_data():
-    conn = connect_db()
-    if conn is None:
-        return pd.DataFrame()
-    query = """
-    SELECT 
-        od.order_id,
-        od.product_sku,
-        od.product_name,
-        p.product_category,
-        od.order_date,
-        od.product_qty
-    FROM OrdersDespatch od
-    LEFT JOIN Products p ON od.product_sku = p.product_sku
-    WHERE od.order_date >= '2023-06-01'
-    """
-    df = pd.read_sql(query, conn)
-    conn.close()
-    df['order_date'] = pd.to_datetime(df['order_date'])
-    return df
+@st.cache_resource
+def get_forecast_cache():
+    return ForecastCache()
+
+# A dense SKU x day matrix per entry, so only the last few filter combinations are kept
+DEMAND_CACHE_ENTRIES = 8
+
+@st.cache_resource(max_entries=DEMAND_CACHE_ENTRIES, show_spinner=False)
+def load_demand(loaded_at, sku_terms, name_terms, cat_terms, _filtered_df, _end_date):
+    # Keyed on the data load and the search terms, which decide the unhashed arguments;
+    # the matrix keeps its cumulative sums, so the window totals are reused as well
+    return build_demand_matrix(_filtered_df, 'product_sku', 'order_date', 'product_qty', end_date=_end_date)
 
 # Load data
-df = load_data()
+with timer.section("load"):
+    lines, df = load_data()
 if df.empty:
     st.stop()
 
+refresh_button()
+with st.sidebar.expander("🧠 Cached Data Memory"):
+    st.dataframe(memory_report(["order_lines"]), hide_index=True)
+
 # ------------------ TOP FILTERS ------------------
 st.markdown("### 🎯 Smart Search Filters")
 col1, col2, col3 = st.columns(3)
@@ -65,22 +72,16 @@ sku_terms = [term.strip().lower() for term in sku_input.split(',') if term.strip
 name_terms = [term.strip().lower() for term in name_input.split(',') if term.strip()]
 cat_terms = [term.strip().lower() for term in cat_input.split(',') if term.strip()]
 
-filtered_df = df.copy()
-if sku_terms:
-    sku_mask = pd.Series(False, index=filtered_df.index)
-    for term in sku_terms:
-        sku_mask |= filtered_df['product_sku'].astype(str).str.lower().str.contains(term)
-    filtered_df = filtered_df[sku_mask]
-if name_terms:
-    name_mask = pd.Series(False, index=filtered_df.index)
-    for term in name_terms:
-        name_mask |= filtered_df['product_name'].astype(str).str.lower().str.contains(term)
-    filtered_df = filtered_df[name_mask]
-if cat_terms:
-    cat_mask = pd.Series(False, index=filtered_df.index)
-    for term in cat_terms:
-        cat_mask |= filtered_df['product_category'].astype(str).str.lower().str.contains(term)
-    filtered_df = filtered_df[cat_mask]
+# Every filter ANDs into one mask over the shared frame; rows are materialised once
+with timer.section("filter"):
+    # Terms resolve to product keys through the search index built once per data load
+    search = lines.derived("search", ProductSearchIndex)
+    mask = pd.Series(search.mask({
+        'product_sku': sku_terms,
+        'product_name': name_terms,
+        'product_category': cat_terms,
+    }), index=df.index)
+    filtered_df = apply_mask(df, mask)
 
 if filtered_df.empty:
     st.warning("No data available for selected filters.")
@@ -98,6 +99,14 @@ with col4:
 with col5:
     safety_pct = st.slider("📦 Safety Stock %", min_value=0, max_value=100, value=20, step=5)
 
+engine_options = {
+    "Auto (Prophet for top sellers, fast model for the long tail)": "auto",
+    "Prophet (all SKUs)": "prophet",
+    "Fast statistical model (all SKUs)": "fast",
+}
+engine_label = st.selectbox("🧠 Forecast Engine", list(engine_options))
+engine = engine_options[engine_label]
+
 range_map = {
     "Next 7 Days": 7,
     "Next 30 Days": 30,
@@ -115,23 +124,50 @@ col_f1, col_f2 = st.columns([0.8, 0.2])
 with col_f1:
     st.write("")
 
-forecast_df = forecast_multiple_skus(
-    df=filtered_df,
-    sku_col='product_sku',
-    date_col='order_date',
-    qty_col='product_qty',
-    forecast_days=max(forecast_days_list)
-)
+forecast_progress = st.progress(0.0, text="Fitting SKU forecasts...")
+
+def update_forecast_progress(sku, done, total):
+    forecast_progress.progress(done / total, text=f"Fitted {done} / {total} SKUs")
+
+prophet_engine = ProphetForecaster(n_jobs=None, cache=get_forecast_cache(), on_result=update_forecast_progress)
+if engine == "auto":
+    forecaster = VolumeRouter(high=prophet_engine, low=NumpyForecaster("sba"))
+elif engine == "fast":
+    forecaster = NumpyForecaster("sba")
+else:
+    forecaster = prophet_engine
+
+# One SKU x day matrix feeds both the forecasters and the historical windows below;
+# the grid runs to the latest date in the unfiltered data. It is built once per data
+# load and filter combination, so other widgets reuse it.
+with timer.section("forecast"):
+    demand = load_demand(
+        lines.loaded_at, tuple(sku_terms), tuple(name_terms), tuple(cat_terms),
+        filtered_df, df['order_date'].max()
+    )
+
+    forecast_df = forecast_multiple_skus(
+        df=filtered_df,
+        sku_col='product_sku',
+        date_col='order_date',
+        qty_col='product_qty',
+        forecast_days=max(forecast_days_list),
+        forecaster=forecaster,
+        demand=demand
+    )
+forecast_progress.empty()
+
+cache_stats = get_forecast_cache().stats()
+st.caption(f"🗄️ Forecast cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['entries']} models stored")
 
 if forecast_df.empty:
     st.info("⚠️ No SKUs with sufficient historical data (≥30 days). Try different filters.")
     st.stop()
 
 # Compute historical sales summary (last 7, 30, 120 days)
-today = pd.to_datetime(df['order_date'].max())
-hist_7d = filtered_df[filtered_df['order_date'] >= today - timedelta(days=6)].groupby('product_sku')['product_qty'].sum().rename("qty_last_7d")
-hist_30d = filtered_df[filtered_df['order_date'] >= today - timedelta(days=29)].groupby('product_sku')['product_qty'].sum().rename("qty_last_30d")
-hist_120d = filtered_df[filtered_df['order_date'] >= today - timedelta(days=119)].groupby('product_sku')['product_qty'].sum().rename("qty_last_120d")
+hist_7d = demand.window_totals(7).rename("qty_last_7d")
+hist_30d = demand.window_totals(30).rename("qty_last_30d")
+hist_120d = demand.window_totals(120).rename("qty_last_120d")
 
 # Pivot forecasted results
 forecast_pivot = (
@@ -148,20 +184,16 @@ forecast_summary = pd.DataFrame(index=forecast_pivot.index)
 for days in forecast_days_list:
     forecast_summary[f"forecast_qty_{days}d"] = forecast_pivot.loc[:, :days].sum(axis=1)
 
+# Everything the forecast tables depend on, for the export cache
+forecast_fingerprint = (lines.loaded_at, sku_terms, name_terms, cat_terms, engine, forecast_days_list)
+
 # Merge with historical data
 forecast_summary = forecast_summary.join([hist_7d, hist_30d, hist_120d])
 forecast_summary.reset_index(inplace=True)
 forecast_summary.fillna(0, inplace=True)
 
 with col_f2:
-    forecast_csv = prepare_forecast_csv(forecast_summary)
-    st.download_button(
-        label="⬇️ Download CSV",
-        data=forecast_csv,
-        file_name="forecast_summary.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    download(forecast_summary, "forecast_summary", fingerprint=forecast_fingerprint, use_container_width=True)
 
 st.dataframe(forecast_summary, use_container_width=True)
 
@@ -182,13 +214,8 @@ rec_df['po_quantity'] = rec_df['recommended_inventory'] - rec_df['current_invent
 rec_df['po_quantity'] = rec_df['po_quantity'].apply(lambda x: max(0, round(x)))
 
 with col_i2:
-    rec_csv = prepare_forecast_csv(rec_df)
-    st.download_button(
-        label="⬇️ Download CSV",
-        data=rec_csv,
-        file_name="inventory_recommendation.csv",
-        mime="text/csv",
-        use_container_width=True
+    download(
+        rec_df, "inventory_recommendation", fingerprint=(forecast_fingerprint, safety_pct), use_container_width=True
     )
 
 st.dataframe(
@@ -0,0 +1,282 @@
+import logging
+import threading
+import time
+import weakref
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from utils.dateranges import DateWindow
+from utils.db import run_batch, run_query
+from utils.frames import compact
+from utils.queries import product_facets
+from utils.rollups import ensure_fresh, read_rollup
+from utils.store import load_last_sales, load_order_lines, sync_store
+
+# One superset frame per source table, shared by every page and session through
+# st.cache_resource. Pages never receive the registry's own frame: view() and window()
+# hand out column projections, which pages can modify freely. Under copy-on-write (the
+# default from pandas 3) a projection shares the column buffers until it is written to;
+# on older pandas it is a copy.
+
+DEFAULT_TTL = 3600
+# How often the background refresher looks for datasets past their TTL
+REFRESH_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+ORDER_LINE_COLUMNS = [
+    'order_id',
+    'product_sku',
+    'product_name',
+    'product_category',
+    'order_channel',
+    'order_date',
+    'product_qty',
+    'product_price',
+]
+
+
+def _load_order_lines():
+    # Union of the columns pages 6 and 7 used to pull separately
+    sync_store()
+    df = load_order_lines(ORDER_LINE_COLUMNS)
+    df['order_date'] = pd.to_datetime(df['order_date'])
+    df['sale_amount'] = df['product_qty'] * df['product_price']
+    return df
+
+
+def _load_last_sales():
+    # Syncs first, like order_lines, so a reload never reads an index older than its frame
+    sync_store()
+    return load_last_sales()
+
+
+def _rollup_loader(table):
+    # All stored history; pages cut it down to their own window with a mask
+    def load():
+        ensure_fresh()
+        return read_rollup(table)
+    return load
+
+
+def _load_products():
+    return run_query("SELECT * FROM Products")
+
+
+def _project(frame, columns=None):
+    # Selecting by a column list never hands back the shared frame itself
+    return frame[list(columns) if columns is not None else list(frame.columns)]
+
+
+class Snapshot:
+    # One loaded frame and the structures derived from it (search and facet indexes).
+    # A page that needs a frame and an index over it takes both from one snapshot, so a
+    # background reload landing in between can't pair the frame with another load's index.
+    def __init__(self, frame, loaded_at):
+        self.frame = frame
+        self.loaded_at = loaded_at
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def view(self, columns=None):
+        return _project(self.frame, columns)
+
+    def derived(self, key, builder):
+        # Built once per snapshot and dropped with it
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = builder(self.frame)
+            return self._derived[key]
+
+
+class Dataset:
+    def __init__(self, name, loader, ttl=DEFAULT_TTL, schema=None, sort_by=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.schema = schema
+        # Date column the frame is held sorted by, so window() can slice it
+        self.sort_by = sort_by
+        self.loaded_at = None
+        self.last_error = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    @property
+    def expired(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def _build(self):
+        frame = compact(self.loader(), schema=self.schema, label=self.name)
+        if self.sort_by:
+            frame = frame.sort_values(self.sort_by, kind="stable", ignore_index=True)
+        return frame
+
+    def _swap(self, frame):
+        with self._lock:
+            self._snapshot = Snapshot(frame, time.monotonic())
+            self.loaded_at = self._snapshot.loaded_at
+
+    def snapshot(self):
+        # Stale-while-revalidate: a loaded snapshot is always served, even past its TTL,
+        # while a reload runs in the background. Only the very first load blocks, and
+        # concurrent sessions wait for that one loader call instead of repeating it.
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if self.expired:
+                self.reload_async()
+            return snapshot
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = Snapshot(self._build(), time.monotonic())
+                self.loaded_at = self._snapshot.loaded_at
+            return self._snapshot
+
+    def reload(self, wait=True):
+        # Builds the next frame while the current snapshot keeps being served, then swaps
+        # in a new snapshot. Returns False when a reload was already running and wait is
+        # False.
+        if not self._reload_lock.acquire(blocking=wait):
+            return False
+        try:
+            try:
+                frame = self._build()
+            except Exception as e:
+                self.last_error = e
+                raise
+            self.last_error = None
+            self._swap(frame)
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def reload_async(self):
+        if self._reload_lock.locked():
+            return
+        threading.Thread(target=self._reload_quietly, name=f"reload-{self.name}", daemon=True).start()
+
+    def _reload_quietly(self):
+        try:
+            self.reload(wait=False)
+        except Exception:
+            logger.exception("Background reload of %s failed; serving the previous snapshot", self.name)
+
+    def derived(self, key, builder):
+        # For an index used on its own; pages pairing it with a frame take a snapshot
+        return self.snapshot().derived(key, builder)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self.loaded_at = None
+
+
+class DatasetRegistry:
+    def __init__(self):
+        self._datasets = {}
+
+    def register(self, dataset):
+        self._datasets[dataset.name] = dataset
+        return dataset
+
+    def __getitem__(self, name):
+        return self._datasets[name]
+
+    def __iter__(self):
+        return iter(self._datasets.values())
+
+    def invalidate(self, name=None):
+        for dataset in ([self[name]] if name else self):
+            dataset.invalidate()
+
+    def refresh_all(self):
+        # Reloads only what has been loaded before; the rest stays lazy. Readers keep the
+        # old snapshots until each new one is swapped in.
+        for dataset in self:
+            if dataset.loaded_at is not None:
+                dataset.reload()
+
+    def refresh_expired(self):
+        for dataset in self:
+            if dataset.loaded_at is not None and dataset.expired:
+                try:
+                    dataset.reload(wait=False)
+                except Exception:
+                    logger.exception("Scheduled reload of %s failed; serving the previous snapshot", dataset.name)
+
+
+class BackgroundRefresher:
+    # Daemon thread that reloads expired datasets every `interval` seconds, so pages find
+    # fresh snapshots instead of triggering the reload themselves. It only holds a weak
+    # reference and exits once its registry is gone (e.g. after a cache clear).
+    def __init__(self, registry, interval=REFRESH_INTERVAL):
+        self._registry = weakref.ref(registry)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="dataset-refresher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            registry = self._registry()
+            if registry is None:
+                return
+            registry.refresh_expired()
+            del registry
+
+    def stop(self):
+        self._stop.set()
+
+
+@st.cache_resource
+def get_registry():
+    registry = DatasetRegistry()
+    registry.register(Dataset("order_lines", _load_order_lines))
+    registry.register(Dataset("last_sale", _load_last_sales, schema={"product_sku": "string", "product_name": "string"}))
+    for table in ("order_rollup", "sku_rollup", "postcode_rollup"):
+        registry.register(Dataset(table, _rollup_loader(table), sort_by="despatch_date"))
+    # One row per product, so the key columns stay plain strings
+    registry.register(Dataset("products", _load_products, schema={"product_sku": "string", "product_name": "string"}))
+    registry.register(Dataset("product_facets", product_facets, schema={"product_sku": "string", "product_name": "string"}))
+    # Started here so there is exactly one per server, alongside the registry it refreshes
+    registry.refresher = BackgroundRefresher(registry)
+    return registry
+
+
+def snapshot(name):
+    return get_registry()[name].snapshot()
+
+
+def view(name, columns=None):
+    return snapshot(name).view(columns)
+
+
+def window(name, start=None, end=None, columns=None):
+    # Rows with start <= sort_by date <= end, as a slice of the sorted shared frame
+    dataset = get_registry()[name]
+    # DateWindow keeps the frame it indexes, so the slice and its offsets always agree
+    index = dataset.derived(("window", dataset.sort_by), lambda frame: DateWindow(frame, dataset.sort_by))
+    return _project(index.slice(start, end), columns)
+
+
+def load_batch(jobs, max_workers=None):
+    # run_batch for page code: the worker threads share the rerun's script context, so
+    # jobs can be st.cache_data loaders and a warm cache entry costs no connection
+    ctx = get_script_run_ctx()
+    return run_batch(
+        jobs, max_workers=max_workers, initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    )
+
+
+def refresh_all():
+    get_registry().refresh_all()
+
+
+def refresh_button():
+    if st.sidebar.button("🔄 Refresh All Data"):
+        with st.spinner("Reloading shared datasets..."):
+            refresh_all()
+        st.rerun()
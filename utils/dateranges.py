@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+# Date ranges for every page: the quick-range options resolve here, against the latest
+# day with data, and date windows over the shared frames are cut with DateWindow. The
+# registry keeps those frames sorted by their date column, so a window is two binary
+# searches over the distinct dates and an iloc slice instead of a boolean scan.
+
+QUICK_RANGES = ["None", "Yesterday", "Last 7 Days", "Last 30 Days", "Last 3 Months", "Last 6 Months", "Last 12 Months"]
+
+# How far each option reaches back from the latest day (which it includes)
+_LOOKBACK = {
+    "Yesterday": relativedelta(),
+    "Last 7 Days": relativedelta(days=6),
+    "Last 30 Days": relativedelta(days=29),
+    "Last 3 Months": relativedelta(months=3),
+    "Last 6 Months": relativedelta(months=6),
+    "Last 12 Months": relativedelta(months=12),
+}
+
+
+def quick_range(option, latest):
+    # (start, end) for a quick option, ending on the latest day with data
+    if latest is None or option not in _LOOKBACK:
+        return None, None
+    latest = pd.Timestamp(latest).normalize()
+    return latest - _LOOKBACK[option], latest
+
+
+def resolve_range(option, picked, latest, default_days=None):
+    # A quick option wins over the date picker. One picked day is a one-day range; with
+    # nothing chosen the range is the default_days before the latest day, or (None, None)
+    # when there is no default.
+    if option != "None":
+        return quick_range(option, latest)
+    if len(picked) == 1:
+        day = pd.Timestamp(picked[0])
+        return day, day
+    if len(picked) == 2:
+        return pd.Timestamp(picked[0]), pd.Timestamp(picked[1])
+    if default_days is None:
+        return None, None
+    end = pd.Timestamp(latest).normalize() if latest is not None else pd.Timestamp.today().normalize()
+    return end - timedelta(days=default_days), end
+
+
+class DateWindow:
+    # Row offsets of a frame sorted by `column`: the distinct dates and the row each one
+    # starts at. Missing dates sort last and never fall inside a window.
+    def __init__(self, df, column):
+        dates = df[column]
+        self.n_dated = int(dates.notna().sum())
+        dated = dates.iloc[:self.n_dated]
+        if not (dated.notna().all() and dated.is_monotonic_increasing):
+            # Registry frames arrive sorted; anything else is sorted into a copy here
+            df = df.sort_values(column, kind="stable", ignore_index=True)
+            dates = df[column]
+        self.frame = df
+        self.column = column
+        self.dates, self.offsets = np.unique(dates.to_numpy()[:self.n_dated], return_index=True)
+
+    def _offset(self, value, side):
+        i = self.dates.searchsorted(np.datetime64(pd.Timestamp(value)), side=side)
+        return int(self.offsets[i]) if i < len(self.dates) else self.n_dated
+
+    def bounds(self, start=None, end=None):
+        # Row range [lo, hi) with start <= date <= end, like Series.between
+        lo = 0 if start is None else self._offset(start, "left")
+        hi = self.n_dated if end is None else self._offset(end, "right")
+        return lo, max(lo, hi)
+
+    def slice(self, start=None, end=None):
+        lo, hi = self.bounds(start, end)
+        return self.frame.iloc[lo:hi]
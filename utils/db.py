@@ -1,29 +1,397 @@
-import pyodbc
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import pyodbc
+except ImportError:  # allows the SQLite/DuckDB backends to run offline
+    pyodbc = None
+
+DEFAULT_SERVER = "mptcecommerce-sql-server.database.windows.net"
+DEFAULT_DATABASE = "mptcecommerce-db"
+DEFAULT_USERNAME = "mptcadmin"
+DEFAULT_PASSWORD = "Mptc@2025"
+
+
+def build_connection_string(server, database, username, password):
+    return (
+        f"Driver={{ODBC Driver 17 for SQL Server}};"
+        f"Server={server};"
+        f"Database={database};"
+        f"Uid={username};"
+        f"Pwd={password};"
+        f"Encrypt=yes;"
+        f"TrustServerCertificate=no;"
+        f"Connection Timeout=30;"
+    )
+
 
 def connect_db(server=None, database=None, username=None, password=None):
     if server and database and username and password:
         # Home.py will pass arguments → use them
-        connection_string = (
-            f"Driver={{ODBC Driver 17 for SQL Server}};"
-            f"Server={server};"
-            f"Database={database};"
-            f"Uid={username};"
-            f"Pwd={password};"
-            f"Encrypt=yes;"
-            f"TrustServerCertificate=no;"
-            f"Connection Timeout=30;"
-        )
+        connection_string = build_connection_string(server, database, username, password)
     else:
         # Default for other pages
-        connection_string = (
-            "Driver={ODBC Driver 17 for SQL Server};"
-            "Server=mptcecommerce-sql-server.database.windows.net;"
-            "Database=mptcecommerce-db;"
-            "Uid=mptcadmin;"
-            "Pwd=Mptc@2025;"
-            "Encrypt=yes;"
-            "TrustServerCertificate=no;"
-            "Connection Timeout=30;"
+        connection_string = build_connection_string(
+            DEFAULT_SERVER, DEFAULT_DATABASE, DEFAULT_USERNAME, DEFAULT_PASSWORD
         )
 
     return pyodbc.connect(connection_string)
+
+
+# ------------------ BACKENDS ------------------
+class OdbcBackend:
+    name = "odbc"
+
+    def __init__(self, connection_string=None):
+        self.connection_string = connection_string or build_connection_string(
+            DEFAULT_SERVER, DEFAULT_DATABASE, DEFAULT_USERNAME, DEFAULT_PASSWORD
+        )
+
+    @property
+    def transient_errors(self):
+        if pyodbc is None:
+            return ()
+        return (pyodbc.OperationalError, pyodbc.InterfaceError)
+
+    def connect(self):
+        if pyodbc is None:
+            raise RuntimeError("pyodbc is not installed; use a SQLite or DuckDB backend instead")
+        return pyodbc.connect(self.connection_string)
+
+    def ping(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+class SqliteBackend:
+    name = "sqlite"
+    transient_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # Pooled connections are handed between Streamlit script threads
+        return sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            uri=self.path.startswith("file:"),
+        )
+
+    def ping(self, conn):
+        conn.execute("SELECT 1").fetchall()
+
+
+class DuckDbBackend:
+    name = "duckdb"
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+
+    @property
+    def transient_errors(self):
+        import duckdb
+        return (duckdb.IOException,)
+
+    def connect(self):
+        import duckdb
+        return duckdb.connect(self.path)
+
+    def ping(self, conn):
+        conn.execute("SELECT 1").fetchall()
+
+
+def backend_from_url(url):
+    # sqlite:///data/local.db, duckdb:///data/local.duckdb, or a raw ODBC string
+    if not url:
+        return OdbcBackend()
+    if url.startswith("sqlite://"):
+        return SqliteBackend(url[len("sqlite:///"):] or ":memory:")
+    if url.startswith("duckdb://"):
+        return DuckDbBackend(url[len("duckdb:///"):] or ":memory:")
+    return OdbcBackend(url)
+
+
+# ------------------ BULK FETCH ------------------
+# Rows are pulled with fetchmany in large batches and transposed straight into Arrow
+# column chunks, so no per-row Python objects outlive a batch and pandas never has to
+# infer dtypes from tuples. Queries can declare dtypes per column, e.g.
+# {"order_channel": "category", "order_date": "datetime64[ns]", "product_price": "float32"}.
+
+FETCH_BATCH_SIZE = 50_000
+
+ARROW_TYPES = {
+    "datetime64[ns]": pa.timestamp("ns"),
+    "float64": pa.float64(),
+    "float32": pa.float32(),
+    "int64": pa.int64(),
+    "int32": pa.int32(),
+    "string": pa.string(),
+    "category": pa.string(),  # dictionary-encoded once all batches are in
+}
+
+
+def _merge_chunks(chunks, dtype):
+    target = ARROW_TYPES.get(dtype)
+    if target is None:
+        types = {chunk.type for chunk in chunks if chunk.type != pa.null()}
+        if not types:
+            target = pa.null()
+        elif len(types) == 1:
+            target = types.pop()
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t) for t in types):
+            target = pa.float64()
+        else:
+            target = pa.string()
+        # Match read_sql(coerce_float=True): DECIMAL columns come back as floats
+        if pa.types.is_decimal(target):
+            target = pa.float64()
+    column = pa.chunked_array([chunk if chunk.type == target else chunk.cast(target) for chunk in chunks], type=target)
+    return column.dictionary_encode() if dtype == "category" else column
+
+
+def frame_from_cursor(cursor, dtypes=None, batch_size=FETCH_BATCH_SIZE):
+    dtypes = dtypes or {}
+    columns = [col[0] for col in cursor.description]
+    chunks = [[] for _ in columns]
+    try:
+        cursor.arraysize = batch_size
+    except AttributeError:
+        pass
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for i, values in enumerate(zip(*rows)):
+            chunks[i].append(pa.array(values, from_pandas=True))
+
+    if not chunks or not chunks[0]:
+        return pd.DataFrame(columns=columns)
+    table = pa.table({name: _merge_chunks(chunks[i], dtypes.get(name)) for i, name in enumerate(columns)})
+    return table.to_pandas()
+
+
+# ------------------ CONNECTION POOL ------------------
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        backend,
+        max_size=4,
+        idle_timeout=300,
+        health_check_interval=30,
+        retries=3,
+        backoff=0.5,
+        acquire_timeout=30,
+        statement_cache_size=32,
+    ):
+        self.backend = backend
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.acquire_timeout = acquire_timeout
+        self.statement_cache_size = statement_cache_size
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._statements = {}  # id(connection) -> OrderedDict of SQL text -> cursor
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    def _close_quietly(self, conn):
+        self._statements.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _cursor_for(self, conn, sql):
+        # pyodbc skips SQLPrepare when a cursor re-executes the SQL text it last ran, so
+        # each connection keeps one cursor per recent statement (sqlite3 caches internally)
+        cursors = self._statements.setdefault(id(conn), OrderedDict())
+        cursor = cursors.pop(sql, None)
+        if cursor is None:
+            cursor = conn.cursor()
+            if len(cursors) >= self.statement_cache_size:
+                _, oldest = cursors.popitem(last=False)
+                try:
+                    oldest.close()
+                except Exception:
+                    pass
+        cursors[sql] = cursor
+        return cursor
+
+    def _evict_idle(self):
+        # Caller holds the lock; oldest connections sit at the front of the list
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def _open(self):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.backend.connect()
+            except self.backend.transient_errors:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _is_healthy(self, conn):
+        try:
+            self.backend.ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            self._evict_idle()
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise PoolTimeout(f"No {self.backend.name} connection free after {self.acquire_timeout}s")
+
+        # Connections that sat idle for a while are pinged before reuse
+        if conn is not None and time.monotonic() - last_used > self.health_check_interval:
+            if not self._is_healthy(conn):
+                self._close_quietly(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            if broken:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except self.backend.transient_errors:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def query(self, sql, params=None, dtypes=None):
+        for attempt in range(self.retries + 1):
+            try:
+                with self.connection() as conn:
+                    cursor = self._cursor_for(conn, sql)
+                    if params:
+                        cursor.execute(sql, list(params))
+                    else:
+                        cursor.execute(sql)
+                    return frame_from_cursor(cursor, dtypes)
+            except self.backend.transient_errors:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+
+# ------------------ PROCESS-WIDE POOL ------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(backend_from_url(os.environ.get("MPTC_DB_URL")))
+        return _pool
+
+
+def set_backend(backend, **pool_options):
+    # Swap the shared pool, e.g. set_backend(SqliteBackend("local.db")) for offline runs
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(backend, **pool_options)
+        return _pool
+
+
+def run_query(sql, params=None, dtypes=None):
+    return get_pool().query(sql, params=params, dtypes=dtypes)
+
+
+# ------------------ BATCHES ------------------
+def _run_job(job):
+    if callable(job):
+        return job()
+    if isinstance(job, str):
+        return run_query(job)
+    return run_query(*job)
+
+
+def run_batch(jobs, max_workers=None, initializer=None):
+    # jobs: {name: SQL text, (sql, params[, dtypes]) or a zero-argument callable such as
+    # a query helper}. Each job runs in a worker thread on its own pooled connection, so
+    # the batch takes about as long as its slowest query rather than their sum. Returns
+    # {name: frame}; if any job fails, the first failure is raised once all have finished.
+    if not jobs:
+        return {}
+    workers = max_workers or min(len(jobs), get_pool().max_size)
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer, thread_name_prefix="query-batch") as executor:
+        futures = {name: executor.submit(_run_job, job) for name, job in jobs.items()}
+    return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+# Dead-stock table for the product analysis page, built from the last_sale index (one
+# row per SKU and name) rather than regrouping the order history. Buckets come from one
+# np.digitize over the day counts, and the "Time Since Last Sale" text is worked out once
+# per distinct sale date, of which there are a few hundred however many SKUs there are.
+
+# Fixed display order; ranges are inclusive day counts
+UNSOLD_BUCKETS = {
+    "7 days to 1 month": (7, 30),
+    "1 to 3 months": (31, 90),
+    "3 to 6 months": (91, 180),
+    "6 months to 1 year": (181, 365),
+    "more than 1 year": (366, float("inf")),
+}
+BUCKET_ORDER = list(UNSOLD_BUCKETS)
+_BUCKET_EDGES = np.array([low for low, _ in UNSOLD_BUCKETS.values()])
+
+
+def time_since(date, today):
+    delta = relativedelta(today, date)
+    parts = []
+    if delta.years: parts.append(f"{delta.years} yr{'s' if delta.years > 1 else ''}")
+    if delta.months: parts.append(f"{delta.months} mo")
+    if delta.days: parts.append(f"{delta.days} d")
+    return " ".join(parts) if parts else "Today"
+
+
+def time_since_labels(dates, today):
+    # dates: datetime Series; one relativedelta per distinct calendar day
+    codes, days = pd.factorize(dates.dt.normalize())
+    labels = np.array([time_since(day.date(), today.date()) for day in days] + [None], dtype=object)
+    return labels[codes]
+
+
+def unsold_buckets(days):
+    # Bucket per day count; fewer than 7 days (or no sale date) is no bucket
+    days = np.asarray(days, dtype=float)
+    codes = np.digitize(np.nan_to_num(days, nan=-1), _BUCKET_EDGES) - 1
+    return pd.Categorical.from_codes(codes, categories=BUCKET_ORDER)
+
+
+def dead_stock_table(last_sales, today):
+    # last_sales: product_sku, product_name, order_date; today: a normalised Timestamp
+    last_sold = last_sales.sort_values(['product_sku', 'product_name'], ignore_index=True)
+    order_date = pd.to_datetime(last_sold['order_date'])
+    days = (today - order_date).dt.days
+    return last_sold.assign(**{
+        'Days Since Last Sale': days,
+        'Last Sold': order_date.dt.strftime('%Y-%m-%d'),
+        'Time Since Last Sale': time_since_labels(order_date, today),
+        'Bucket': unsold_buckets(days),
+    })
+
+
+def sku_categories(df):
+    # Distinct (product_sku, product_category) pairs, keyed by plain-string SKU
+    pairs = df[['product_sku', 'product_category']].dropna(subset=['product_category']).drop_duplicates()
+    return pairs.astype({'product_sku': 'string'})
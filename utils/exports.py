@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import io
+import threading
+import zipfile
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+# Download files are built only when someone asks for one. Frames are encoded in row
+# chunks straight into the (optionally compressed) output buffer, so the full CSV text
+# never exists as one string, and the finished bytes are cached per filter fingerprint
+# so a second click, or another session with the same filters, costs nothing.
+
+CHUNK_ROWS = 100_000
+EXPORT_CACHE_BYTES = 256 * 2**20
+
+# label -> (file extension, MIME type)
+FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "CSV (zip)": ("zip", "application/zip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _write_csv(df, binary_stream, chunk_rows=CHUNK_ROWS):
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8", newline="")
+    for start in range(0, max(len(df), 1), chunk_rows):
+        df.iloc[start:start + chunk_rows].to_csv(text, index=False, header=start == 0)
+    text.flush()
+    text.detach()
+
+
+def export_bytes(df, fmt, file_stem="export", chunk_rows=CHUNK_ROWS):
+    buffer = io.BytesIO()
+    if fmt == "CSV":
+        _write_csv(df, buffer, chunk_rows)
+    elif fmt == "CSV (gzip)":
+        with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as stream:
+            _write_csv(df, stream, chunk_rows)
+    elif fmt == "CSV (zip)":
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(f"{file_stem}.csv", "w", force_zip64=True) as stream:
+                _write_csv(df, stream, chunk_rows)
+    elif fmt == "Parquet":
+        writer = None
+        for start in range(0, max(len(df), 1), chunk_rows):
+            table = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema)
+            writer.write_table(table)
+        writer.close()
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return buffer.getvalue()
+
+
+class ExportCache:
+    # Finished files keyed by (fingerprint, format), evicted least recently used first
+    # once their total size passes max_bytes
+
+    def __init__(self, max_bytes=EXPORT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(fingerprint, fmt):
+        return hashlib.sha256(repr((fingerprint, fmt)).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._entries[key] = data
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+@st.cache_resource
+def get_export_cache():
+    return ExportCache()
+
+
+def _offer(key, build, file_name, mime, widget_key):
+    cache = get_export_cache()
+    payload = cache.get(key)
+    if payload is None and st.button("Prepare file", key=f"{widget_key}_prepare"):
+        with st.spinner("Building file..."):
+            payload = build()
+        cache.put(key, payload)
+    if payload is not None:
+        st.download_button(
+            f"⬇️ {file_name} ({len(payload) / 2**20:,.1f} MB)",
+            payload,
+            file_name=file_name,
+            mime=mime,
+            key=f"{widget_key}_download",
+        )
+
+
+def download(data, file_stem, fingerprint, label="⬇️ Download CSV", use_container_width=False):
+    # data is a frame, or a callable returning one for exports that need their own fetch.
+    # fingerprint must change whenever the exported rows would: filters plus data version.
+    with st.popover(label, use_container_width=use_container_width):
+        fmt = st.radio("Format", list(FORMATS), key=f"{file_stem}_export_format", horizontal=True)
+        extension, mime = FORMATS[fmt]
+        _offer(
+            ExportCache.key((file_stem, fingerprint), fmt),
+            lambda: export_bytes(data() if callable(data) else data, fmt, file_stem),
+            f"{file_stem}.{extension}", mime, f"{file_stem}_export",
+        )
+
+
+def download_file(build, file_name, mime, fingerprint, label, use_container_width=False):
+    # For files with their own renderer (e.g. Excel reports): build() returns the bytes
+    with st.popover(label, use_container_width=use_container_width):
+        _offer(ExportCache.key((file_name, fingerprint), None), build, file_name, mime, f"{file_name}_export")
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Faceted filtering for the product portal. Every facet value owns a row bitmap, so a
+# filter combination is a handful of bitwise ORs (within a facet) and ANDs (across
+# facets), and the option counts for a facet come from the rows matching all the other
+# facets. Selections are memoised per facet, so changing one facet only rebuilds that one.
+
+# Values on at least 1/32 of the rows keep a packed bitset; rarer values are a slice of
+# row ids, which is smaller for them and is expanded into a bitset when selected
+DENSE_FRACTION = 1 / 32
+
+
+class Facet:
+    def __init__(self, values):
+        codes, self.values = pd.factorize(values, sort=True)
+        self.codes = codes.astype(np.int32)
+        self.n_rows = len(codes)
+        self.counts = counts = np.bincount(self.codes[self.codes >= 0], minlength=len(self.values))
+        self._all_options = None
+        # Row ids grouped by value; missing values (code -1) sort first and are skipped
+        self._order = np.argsort(self.codes, kind="stable").astype(np.int32)
+        self._bounds = self.n_rows - int(counts.sum()) + np.concatenate([[0], np.cumsum(counts)])
+        self.dense = {}
+        for value_id in np.flatnonzero(counts >= DENSE_FRACTION * self.n_rows):
+            bits = np.zeros(self.n_rows, dtype=bool)
+            bits[self.rows(value_id)] = True
+            self.dense[int(value_id)] = np.packbits(bits)
+
+    def options(self, counts):
+        present = np.flatnonzero(counts)
+        return dict(zip(self.values[present].tolist(), counts[present].tolist()))
+
+    def all_options(self):
+        # Unfiltered counts are asked for on most reruns, so they are built once
+        if self._all_options is None:
+            self._all_options = self.options(self.counts)
+        return self._all_options
+
+    def rows(self, value_id):
+        return self._order[self._bounds[value_id]:self._bounds[value_id + 1]]
+
+    def bitset(self, value_ids):
+        # OR of the selected values' bitmaps, as a packed bitset
+        packed = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        sparse = []
+        for value_id in value_ids:
+            if value_id in self.dense:
+                packed |= self.dense[value_id]
+            else:
+                sparse.append(self.rows(value_id))
+        if sparse:
+            bits = np.zeros(self.n_rows, dtype=bool)
+            bits[np.concatenate(sparse)] = True
+            packed |= np.packbits(bits)
+        return packed
+
+
+class FacetIndex:
+    def __init__(self, df, columns=None, memo_size=64):
+        self.n_rows = len(df)
+        self.facets = {col: Facet(df[col]) for col in (columns or df.columns)}
+        self.memo_size = memo_size
+        # The index is shared by every session's script thread, so the memo is locked;
+        # bitsets are built outside the lock
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._all = np.packbits(np.ones(self.n_rows, dtype=bool))
+
+    def _value_ids(self, col, values):
+        lookup = self.facets[col].values
+        ids = lookup.get_indexer(list(values))
+        return tuple(sorted(int(i) for i in ids if i >= 0))
+
+    def selection(self, col, values):
+        # Packed bitset for "col is any of values"; None when the facet is unfiltered
+        if not values:
+            return None
+        key = (col, self._value_ids(col, values))
+        with self._memo_lock:
+            bits = self._memo.get(key)
+            if bits is not None:
+                self._memo.move_to_end(key)
+                return bits
+        bits = self.facets[col].bitset(key[1])
+        with self._memo_lock:
+            self._memo[key] = bits
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return bits
+
+    def _intersect(self, bitsets):
+        result = self._all
+        for bits in bitsets:
+            if bits is not None:
+                result = result & bits
+        return result
+
+    def _rows(self, packed):
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    def mask(self, selections):
+        # Row mask for all facets ANDed together
+        return self._rows(self._intersect(self.selection(col, values) for col, values in selections.items()))
+
+    def options(self, selections):
+        # Per facet: {value: count} over the rows matching every *other* facet, so a facet
+        # keeps offering its own alternatives while the others narrow it
+        cols = list(self.facets)
+        bitsets = [self.selection(col, selections.get(col)) for col in cols]
+        # Prefix and suffix intersections give each facet's "all others" set in O(facets)
+        prefix, suffix = [self._all], [self._all]
+        for bits in bitsets:
+            prefix.append(prefix[-1] if bits is None else prefix[-1] & bits)
+        for bits in reversed(bitsets):
+            suffix.append(suffix[-1] if bits is None else suffix[-1] & bits)
+        suffix.reverse()
+
+        filtered = [bits is not None for bits in bitsets]
+        result = {}
+        for i, col in enumerate(cols):
+            facet = self.facets[col]
+            if not any(filtered[:i] + filtered[i + 1:]):
+                result[col] = facet.all_options()
+                continue
+            codes = facet.codes[self._rows(prefix[i] & suffix[i + 1])]
+            result[col] = facet.options(np.bincount(codes[codes >= 0], minlength=len(facet.values)))
+        return result
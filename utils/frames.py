@@ -0,0 +1,114 @@
+import threading
+
+import pandas as pd
+
+# Schema-driven compaction for every frame a page caches. Repeated strings (channels,
+# SKUs, names, postcodes, couriers) become categoricals, integers are downcast and date
+# columns get a proper datetime64 dtype, so cached frames are several times smaller and
+# far cheaper to pickle on every st.cache_data hit.
+
+# Declared kinds for columns that appear across the OrdersDespatch, Products and rollup
+# frames. "date" also normalises to midnight; "string" opts a column out of categoricals.
+COLUMN_SCHEMA = {
+    "order_channel": "category",
+    "order_courier_service": "category",
+    "order_cust_postcode": "category",
+    "customer_name": "category",
+    "product_sku": "category",
+    "product_name": "category",
+    "product_category": "category",
+    "order_date": "datetime",
+    "despatch_date": "datetime",
+    "product_qty": "int",
+    "orders": "int",
+    "order_lines": "int",
+}
+
+# Undeclared text columns become categoricals when at most this share of values is distinct
+CATEGORY_MAX_RATIO = 0.5
+
+# Integers are never downcast below int32, so arithmetic on them later cannot overflow
+MIN_INT_DTYPE = "int32"
+
+_memory_log = {}
+_memory_lock = threading.Lock()
+
+
+def _is_text(series):
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _compact_column(series, kind):
+    if kind == "category":
+        return series.astype("category")
+    if kind in ("date", "datetime"):
+        values = pd.to_datetime(series, errors="coerce")
+        return values.dt.normalize() if kind == "date" else values
+    if kind == "int":
+        if not pd.api.types.is_numeric_dtype(series) or series.isna().any():
+            return series
+        if pd.api.types.is_float_dtype(series) and not (series % 1 == 0).all():
+            return series
+        if series.empty:
+            return series.astype(MIN_INT_DTYPE)
+        downcast = pd.to_numeric(series, downcast="integer")
+        if downcast.dtype.itemsize < pd.api.types.pandas_dtype(MIN_INT_DTYPE).itemsize:
+            return series.astype(MIN_INT_DTYPE)
+        return downcast
+    if kind == "float32":
+        return series.astype("float32")
+    return series
+
+
+def _infer_kind(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return None
+    if _is_text(series):
+        if len(series) and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+            return "category"
+        return None
+    if pd.api.types.is_integer_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return "int"
+    # Floats are left alone: most are money, and float32 sums drift by pennies
+    return None
+
+
+def compact(df, schema=None, label=None):
+    # schema entries override COLUMN_SCHEMA; label records the before/after sizes
+    schema = {**COLUMN_SCHEMA, **(schema or {})}
+    before = int(df.memory_usage(deep=True).sum())
+    df = df.copy(deep=False)
+    for col in df.columns:
+        kind = schema.get(col) or _infer_kind(df[col])
+        if kind == "string" or kind is None:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and kind == "category":
+            continue
+        df[col] = _compact_column(df[col], kind)
+    if label:
+        after = int(df.memory_usage(deep=True).sum())
+        with _memory_lock:
+            _memory_log[label] = {"rows": len(df), "before": before, "after": after}
+    return df
+
+
+def memory_report(labels):
+    # One row per recorded frame, in the order the page asks for them
+    with _memory_lock:
+        rows = [{"frame": label, **_memory_log[label]} for label in labels if label in _memory_log]
+    report = pd.DataFrame(rows, columns=["frame", "rows", "before", "after"])
+    if report.empty:
+        return report
+    if len(report) > 1:
+        total = report[["rows", "before", "after"]].sum()
+        report.loc[len(report)] = ["Total", total["rows"], total["before"], total["after"]]
+    report["before_mb"] = (report["before"] / 2**20).round(2)
+    report["after_mb"] = (report["after"] / 2**20).round(2)
+    report["ratio"] = (report["before"] / report["after"].where(report["after"] > 0)).round(1)
+    return report[["frame", "rows", "before_mb", "after_mb", "ratio"]]
+
+
+def apply_mask(df, mask):
+    # Materialises only the selected rows; an all-True mask hands back the frame itself,
+    # which copy-on-write keeps read-only for the shared datasets behind it
+    return df if mask.all() else df[mask]
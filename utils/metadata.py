@@ -0,0 +1,46 @@
+import pandas as pd
+import streamlit as st
+
+from utils.db import run_query
+from utils.rollups import get_store_pool
+
+# First and last dates per table, and per channel, from one MIN/MAX statement. The pages'
+# quick ranges ("Yesterday", "Last 7 Days", ...) count back from these instead of
+# scanning or sorting a whole date column. Answers are cached for a few minutes.
+
+METADATA_TTL = 300
+
+DATE_COLUMNS = {
+    "OrdersDespatch": ["despatch_date", "order_date"],
+    "order_rollup": ["despatch_date", "order_date"],
+    "sku_rollup": ["despatch_date", "order_date"],
+    "postcode_rollup": ["despatch_date"],
+}
+# Served from the local rollup store rather than Azure SQL
+ROLLUP_TABLES = {"order_rollup", "sku_rollup", "postcode_rollup"}
+
+
+@st.cache_data(ttl=METADATA_TTL, show_spinner=False)
+def date_bounds(table="OrdersDespatch", by_channel=False):
+    # min_<col> and max_<col> for each date column: one row, or one per order_channel
+    # (indexed by channel, sorted)
+    bounds = ", ".join(f"MIN({col}) AS min_{col}, MAX({col}) AS max_{col}" for col in DATE_COLUMNS[table])
+    if by_channel:
+        sql = f"SELECT order_channel, {bounds} FROM {table} WHERE order_channel IS NOT NULL GROUP BY order_channel"
+    else:
+        sql = f"SELECT {bounds} FROM {table}"
+    df = get_store_pool().query(sql) if table in ROLLUP_TABLES else run_query(sql)
+    for col in df.columns:
+        if col != "order_channel":
+            df[col] = pd.to_datetime(df[col])
+    return df.set_index("order_channel").sort_index() if by_channel else df
+
+
+def latest_date(table="OrdersDespatch", column="despatch_date", channel=None):
+    # Last day with data, at midnight; None when there is none
+    if channel is None:
+        value = date_bounds(table).at[0, f"max_{column}"]
+    else:
+        bounds = date_bounds(table, by_channel=True)
+        value = bounds.at[channel, f"max_{column}"] if channel in bounds.index else pd.NaT
+    return None if pd.isna(value) else pd.Timestamp(value).normalize()
@@ -0,0 +1,174 @@
+import pandas as pd
+
+from utils.db import get_pool, run_query
+
+# Builds parameterised, sargable WHERE clauses and server-side GROUP BYs so pages fetch
+# aggregates instead of raw order lines. Date ranges are inclusive calendar days and are
+# expressed as col >= start AND col < end + 1 day, which keeps any index on col usable.
+
+# Declared column types for order-line pulls through the bulk fetch engine
+ORDER_LINE_DTYPES = {
+    "order_channel": "category",
+    "order_date": "datetime64[ns]",
+    "despatch_date": "datetime64[ns]",
+    "order_value": "float64",
+    "product_price": "float32",
+}
+
+DAY_EXPRESSIONS = {
+    "odbc": "CAST({col} AS DATE)",
+    "duckdb": "CAST({col} AS DATE)",
+    "sqlite": "date({col})",
+}
+
+
+class QueryBuilder:
+    def __init__(self, table, dialect=None):
+        self.table = table
+        self.dialect = dialect or get_pool().backend.name
+        self.clauses = []
+        self.params = []
+
+    def between_days(self, col, start, end):
+        if start is None or end is None:
+            return self
+        self.clauses.append(f"{col} >= ? AND {col} < ?")
+        self.params.append(pd.Timestamp(start).normalize().to_pydatetime())
+        self.params.append((pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_pydatetime())
+        return self
+
+    def isin(self, col, values):
+        # None means "no filter"; an empty selection matches nothing
+        if values is None:
+            return self
+        values = list(values)
+        if not values:
+            self.clauses.append("1 = 0")
+        else:
+            self.clauses.append(f"{col} IN ({', '.join('?' * len(values))})")
+            self.params.extend(values)
+        return self
+
+    def day(self, col):
+        return DAY_EXPRESSIONS[self.dialect].format(col=col)
+
+    @property
+    def where(self):
+        return " AND ".join(self.clauses) if self.clauses else "1 = 1"
+
+    def select(self, columns, group_by=None):
+        sql = f"SELECT {', '.join(columns)} FROM {self.table} WHERE {self.where}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+        return sql, list(self.params)
+
+
+def order_filters(despatch_start=None, despatch_end=None, order_start=None, order_end=None, channels=None):
+    return (
+        QueryBuilder("OrdersDespatch")
+        .between_days("despatch_date", despatch_start, despatch_end)
+        .between_days("order_date", order_start, order_end)
+        .isin("order_channel", channels)
+    )
+
+
+def daily_order_totals(**filters):
+    # Orders are deduplicated server-side, then counted and summed per order day and channel
+    builder = order_filters(**filters)
+    inner, params = builder.select(
+        ["DISTINCT order_id", "order_channel", f"{builder.day('order_date')} AS order_date", "order_value"]
+    )
+    sql = f"""
+    SELECT order_date, order_channel, COUNT(order_id) AS orders, SUM(order_value) AS order_value
+    FROM ({inner}) AS dedup_orders
+    GROUP BY order_date, order_channel
+    """
+    df = run_query(sql, params)
+    df["order_date"] = pd.to_datetime(df["order_date"])
+    return df
+
+
+def line_totals(**filters):
+    sql, params = order_filters(**filters).select(
+        ["COUNT(DISTINCT product_sku) AS unique_skus", "SUM(product_qty) AS total_qty"]
+    )
+    return run_query(sql, params)
+
+
+def channel_summary(start_date, end_date):
+    # Constant SQL text with ? markers: the server compiles one plan and reuses it for
+    # every date range, and the pool re-executes it on an already prepared cursor
+    builder = QueryBuilder("OrdersDespatch").between_days("despatch_date", start_date, end_date)
+    inner, params = builder.select(["DISTINCT order_id", "order_channel", "despatch_date", "order_value"])
+    sql = f"""
+    WITH despatch_data AS (
+        {inner}
+    ),
+    channel_total AS (
+        SELECT 
+            order_channel, 
+            SUM(order_value) AS total_orders_value,
+            COUNT(DISTINCT order_id) AS orders_count
+        FROM despatch_data
+        GROUP BY order_channel
+    )
+    SELECT order_channel AS channel, total_orders_value, orders_count
+    FROM channel_total
+    ORDER BY total_orders_value DESC
+    """
+    return run_query(sql, params)
+
+
+def daily_channel_summary(start_date, end_date):
+    # channel_summary split by despatch day, for the per-day and per-channel workbook sheets
+    builder = QueryBuilder("OrdersDespatch").between_days("despatch_date", start_date, end_date)
+    inner, params = builder.select(
+        ["DISTINCT order_id", "order_channel", f"{builder.day('despatch_date')} AS despatch_day", "despatch_date", "order_value"]
+    )
+    sql = f"""
+    SELECT 
+        despatch_day,
+        order_channel AS channel,
+        SUM(order_value) AS total_orders_value,
+        COUNT(DISTINCT order_id) AS orders_count
+    FROM ({inner}) AS despatch_data
+    GROUP BY despatch_day, order_channel
+    """
+    df = run_query(sql, params)
+    df["despatch_day"] = pd.to_datetime(df["despatch_day"])
+    return df.sort_values(["despatch_day", "total_orders_value"], ascending=[True, False], ignore_index=True)
+
+
+# Narrow Products columns the catalogue filters on; the long text columns are only
+# fetched for the rows on screen
+PRODUCT_FACET_COLUMNS = [
+    "product_sku",
+    "product_category",
+    "product_name",
+    "product_source_country",
+    "product_commodity_code",
+    "ean_barcode",
+    "brand_name",
+]
+
+# Keeps IN lists well under SQL Server's 2100 parameter limit
+PRODUCT_KEYS_PER_QUERY = 1000
+
+
+def product_facets():
+    return run_query(f"SELECT {', '.join(PRODUCT_FACET_COLUMNS)} FROM Products")
+
+
+def product_rows(skus):
+    # Full rows for the given SKUs, in the order given. The products portal pages by
+    # slicing its sorted, filtered SKU list locally and passing one slice here, so each
+    # page is an IN (...) lookup on the key, batched under the parameter limit, rather
+    # than an OFFSET scan or a keyset (WHERE product_sku > last) query
+    skus = list(skus)
+    frames = []
+    for start in range(0, max(len(skus), 1), PRODUCT_KEYS_PER_QUERY):
+        sql, params = QueryBuilder("Products").isin("product_sku", skus[start:start + PRODUCT_KEYS_PER_QUERY]).select(["*"])
+        frames.append(run_query(sql, params))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    order = {sku: i for i, sku in enumerate(skus)}
+    return df.sort_values("product_sku", key=lambda col: col.map(order), kind="stable", ignore_index=True)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Mintsoft vs Opera stock reconciliation. Every SKU's delta is spread over its Mintsoft
+# locations in one pass over the whole export: locations are sorted once by SKU, quantity
+# and location, negative deltas are taken from each location in turn up to what is left
+# (a grouped cumulative sum), and positive deltas go to the SKU's first listed location.
+
+REPORT_COLUMNS = ['Client', 'SKU', 'Warehouse', 'Location', 'BestBefore', 'BatchNo', 'SerialNo', 'Quantity', 'Comment']
+ADDED = 'Quantity added to inventory'
+REMOVED = 'Quantity removed from inventory'
+
+
+def stock_deltas(opera_df, mintsoft_df):
+    # opera_df: SKU, Opera_Stock; mintsoft_df: SKU, Location, Mintsoft_Quantity
+    mintsoft_total = mintsoft_df.groupby('SKU')['Mintsoft_Quantity'].sum().reset_index()
+    mintsoft_total.rename(columns={'Mintsoft_Quantity': 'Total_Mintsoft_Stock'}, inplace=True)
+    delta_df = opera_df.merge(mintsoft_total, on='SKU', how='inner')
+    delta_df['Delta_Stock'] = delta_df['Opera_Stock'] - delta_df['Total_Mintsoft_Stock']
+    return delta_df
+
+
+def _additions(deltas, locations):
+    # The first location the SKU appears at in the export
+    first = locations.drop_duplicates('SKU')[['SKU', 'Location']]
+    added = deltas[deltas['Delta_Stock'] > 0].merge(first, on='SKU', how='inner')
+    return pd.DataFrame({
+        '_row': added['_row'].to_numpy(),
+        '_seq': 0,
+        'SKU': added['SKU'].to_numpy(),
+        'Location': added['Location'].to_numpy(),
+        'Quantity': added['Delta_Stock'].to_numpy(),
+        'Comment': ADDED,
+        '_int': added['Delta_Stock'].dtype.kind in 'iu',
+    })
+
+
+def _removals(deltas, locations):
+    # Smallest locations first (ties by location name, then export order), each giving
+    # up min(its quantity, what is still to remove) until nothing is left
+    ordered = locations.sort_values(['SKU', 'Mintsoft_Quantity', 'Location'])
+    ordered = ordered.assign(_seq=np.arange(len(ordered)))
+    removed = deltas[deltas['Delta_Stock'] < 0].merge(ordered, on='SKU', how='inner')
+    removed = removed.iloc[np.lexsort((removed['_seq'].to_numpy(), removed['_row'].to_numpy()))]
+
+    quantity = removed['Mintsoft_Quantity']
+    # Missing quantities don't move the running total, and are reported as missing
+    taken = quantity.fillna(0).groupby(removed['_row'].to_numpy()).cumsum() - quantity.fillna(0)
+    remaining = removed['Delta_Stock'].abs() - taken
+    keep = (remaining > 0).to_numpy()
+    quantity, remaining, removed = quantity[keep], remaining[keep], removed[keep]
+    reduce = np.minimum(quantity.to_numpy(), remaining.to_numpy())
+
+    # min(quantity, remaining) keeps the type of whichever it returns, so a line is
+    # integral when the value it took (the quantity, unless the remainder is smaller) is
+    takes_quantity = ~(remaining < quantity).to_numpy()
+    is_int = np.where(takes_quantity, quantity.dtype.kind in 'iu', removed['Delta_Stock'].dtype.kind in 'iu')
+    return pd.DataFrame({
+        '_row': removed['_row'].to_numpy(),
+        '_seq': removed['_seq'].to_numpy(),
+        'SKU': removed['SKU'].to_numpy(),
+        'Location': removed['Location'].to_numpy(),
+        'Quantity': -reduce,
+        'Comment': REMOVED,
+        '_int': is_int,
+    })
+
+
+def delta_report(opera_df, mintsoft_df):
+    deltas = stock_deltas(opera_df, mintsoft_df)[['SKU', 'Delta_Stock']]
+    deltas = deltas.assign(_row=np.arange(len(deltas)))
+    locations = mintsoft_df[['SKU', 'Location', 'Mintsoft_Quantity']]
+
+    lines = pd.concat([_additions(deltas, locations), _removals(deltas, locations)], ignore_index=True)
+    # Report order: Opera's SKU order, then allocation order within a SKU
+    lines = lines.iloc[np.lexsort((lines['_seq'].to_numpy(), lines['_row'].to_numpy()))]
+
+    quantity = lines['Quantity']
+    if len(lines):
+        quantity = quantity.astype('int64' if lines['_int'].all() else 'float64')
+    report = pd.DataFrame({
+        'Client': 'MPTC',
+        'SKU': lines['SKU'].to_numpy(),
+        'Warehouse': 'Main',
+        'Location': lines['Location'].to_numpy(),
+        'BestBefore': '',
+        'BatchNo': '',
+        'SerialNo': '',
+        'Quantity': quantity.to_numpy(),
+        'Comment': lines['Comment'].to_numpy(),
+    }, columns=REPORT_COLUMNS)
+    report['Location'] = report['Location'].infer_objects()
+    # Zero-quantity lines are dropped after numbering, so the index keeps its gaps
+    return report[report['Quantity'] != 0]
@@ -0,0 +1,121 @@
+import io
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+from openpyxl.utils import get_column_letter
+
+# Excel rendering for the report pages. Workbooks are written in openpyxl's write-only
+# mode, which streams rows to the file instead of keeping a cell grid, and every cell
+# refers to one of three named styles instead of carrying its own Font/Border objects.
+
+TOTAL_LABEL = "Grand Total"
+LAYOUTS = ["Summary only", "One sheet per day", "One sheet per channel"]
+
+
+def _named_styles():
+    thin = Side(style="thin")
+    box = Border(left=thin, right=thin, top=thin, bottom=thin)
+    centre = Alignment(horizontal="center")
+    return [
+        NamedStyle(name="report_label", font=Font(bold=True)),
+        NamedStyle(name="report_cell", alignment=centre, border=box),
+        NamedStyle(name="report_bold_cell", font=Font(bold=True), alignment=centre, border=box),
+    ]
+
+
+def _sheet_title(title, used):
+    # Excel caps sheet names at 31 characters and rejects []:*?/\
+    clean = "".join("-" if ch in '[]:*?/\\' else ch for ch in str(title))[:31] or "Sheet"
+    candidate, n = clean, 2
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate, n = clean[:31 - len(suffix)] + suffix, n + 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def _excel_value(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, "item") else value
+
+
+class ReportWorkbook:
+    def __init__(self):
+        self.workbook = Workbook(write_only=True)
+        for style in _named_styles():
+            self.workbook.add_named_style(style)
+        self._titles = set()
+
+    def _cell(self, sheet, value, style=None):
+        cell = WriteOnlyCell(sheet, value=_excel_value(value))
+        if style:
+            cell.style = style
+        return cell
+
+    def add_table_sheet(self, title, header_rows, df, widths=(30, 20, 15)):
+        # header_rows: (label, value) pairs above a bordered table; the header row and any
+        # row whose first value is TOTAL_LABEL are bold
+        sheet = self.workbook.create_sheet(title=_sheet_title(title, self._titles))
+        for i, width in enumerate(widths, 1):
+            sheet.column_dimensions[get_column_letter(i)].width = width
+        for label, value in header_rows:
+            sheet.append([self._cell(sheet, label, "report_label"), self._cell(sheet, value)])
+        sheet.append([])
+        sheet.append([self._cell(sheet, col, "report_bold_cell") for col in df.columns])
+        for row in df.itertuples(index=False, name=None):
+            style = "report_bold_cell" if row and row[0] == TOTAL_LABEL else "report_cell"
+            sheet.append([self._cell(sheet, value, style) for value in row])
+        return sheet
+
+    def to_bytes(self):
+        output = io.BytesIO()
+        self.workbook.save(output)
+        return output.getvalue()
+
+
+def with_total(df, label_col, sum_cols):
+    total = {col: df[col].sum() for col in sum_cols}
+    return pd.concat([df, pd.DataFrame([{label_col: TOTAL_LABEL, **total}])], ignore_index=True)
+
+
+def _period(start_date, end_date):
+    return f"{start_date.strftime('%d-%m-%Y')} to {end_date.strftime('%d-%m-%Y')}"
+
+
+def channel_summary_workbook(summary, start_date, end_date, daily=None, layout="Summary only"):
+    # summary: channel, total_orders_value, orders_count (Grand Total row included);
+    # daily: the same per despatch_day, needed for the per-day and per-channel layouts
+    report = ReportWorkbook()
+    report.add_table_sheet(
+        "Channel Summary",
+        [
+            ("Selected Despatch Date:", _period(start_date, end_date)),
+            ("Day:", start_date.strftime("%A") if start_date == end_date else "Multiple Days"),
+        ],
+        summary,
+    )
+    value_cols = ["total_orders_value", "orders_count"]
+
+    if layout == "One sheet per day" and daily is not None:
+        for day, rows in daily.groupby("despatch_day", sort=True):
+            report.add_table_sheet(
+                day.strftime("%d-%m-%Y %a"),
+                [("Selected Despatch Date:", day.strftime("%d-%m-%Y")), ("Day:", day.strftime("%A"))],
+                with_total(rows[["channel", *value_cols]], "channel", value_cols),
+            )
+    elif layout == "One sheet per channel" and daily is not None:
+        totals = daily.groupby("channel")["total_orders_value"].sum().sort_values(ascending=False)
+        for channel in totals.index:
+            rows = daily[daily["channel"] == channel].sort_values("despatch_day")
+            rows = rows.assign(despatch_day=rows["despatch_day"].dt.strftime("%d-%m-%Y"))
+            report.add_table_sheet(
+                channel,
+                [("Channel:", channel), ("Selected Despatch Date:", _period(start_date, end_date))],
+                with_total(rows[["despatch_day", *value_cols]], "despatch_day", value_cols),
+            )
+    return report.to_bytes()
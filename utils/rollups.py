@@ -0,0 +1,218 @@
+import argparse
+import os
+import threading
+import time
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from utils.db import ConnectionPool, SqliteBackend, run_query
+
+# Daily summary tables of OrdersDespatch kept in a local SQLite file. Pages read these
+# instead of pulling months of raw order lines; refresh_rollups() recomputes only the
+# days since the last refresh (at least the most recent few), so past days are
+# aggregated once.
+
+ROLLUP_DB_PATH = os.environ.get("MPTC_ROLLUP_DB", os.path.join("data", "rollups.sqlite"))
+HISTORY_MONTHS = 12
+REFRESH_DAYS = 3
+
+ORDER_KEYS = ["order_date", "despatch_date", "order_channel"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_rollup (
+    order_date TEXT, despatch_date TEXT, order_channel TEXT,
+    orders INTEGER, order_value REAL
+);
+CREATE INDEX IF NOT EXISTS ix_order_rollup_despatch ON order_rollup (despatch_date);
+CREATE INDEX IF NOT EXISTS ix_order_rollup_order ON order_rollup (order_date);
+
+CREATE TABLE IF NOT EXISTS sku_rollup (
+    order_date TEXT, despatch_date TEXT, order_channel TEXT,
+    product_sku TEXT, product_name TEXT,
+    product_qty REAL, order_lines INTEGER, orders INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_sku_rollup_despatch ON sku_rollup (despatch_date);
+CREATE INDEX IF NOT EXISTS ix_sku_rollup_order ON sku_rollup (order_date);
+
+CREATE TABLE IF NOT EXISTS postcode_rollup (
+    despatch_date TEXT, order_channel TEXT, order_cust_postcode TEXT,
+    order_lines INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_postcode_rollup_despatch ON postcode_rollup (despatch_date);
+
+CREATE TABLE IF NOT EXISTS rollup_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    history_start TEXT, refreshed_at REAL
+);
+"""
+
+# Lines in the window, plus every not-yet-despatched line in the history window: those
+# groups are rebuilt on each refresh, so an order despatched since leaves them
+SOURCE_QUERY = """
+SELECT order_id, order_channel, order_date, despatch_date, order_value,
+       order_cust_postcode, product_sku, product_name, product_qty
+FROM OrdersDespatch
+WHERE order_date >= ? OR despatch_date >= ? OR (despatch_date IS NULL AND order_date >= ?)
+"""
+
+_store_pool = None
+_store_lock = threading.Lock()
+# Re-entrant so ensure_fresh() can re-check the store and refresh under one hold
+_refresh_lock = threading.RLock()
+
+
+def get_store_pool():
+    global _store_pool
+    with _store_lock:
+        if _store_pool is None:
+            directory = os.path.dirname(ROLLUP_DB_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            _store_pool = ConnectionPool(SqliteBackend(ROLLUP_DB_PATH))
+            with _store_pool.connection() as conn:
+                conn.executescript(SCHEMA)
+        return _store_pool
+
+
+def history_start(today=None):
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+    return today - relativedelta(months=HISTORY_MONTHS)
+
+
+# ------------------ BUILD ------------------
+def build_rollups(lines):
+    # Order-level dedup happens here once, as the pages used to do with
+    # drop_duplicates(subset='order_id') on every rerun. It is per day and channel group,
+    # so an order counts in every despatch window holding one of its lines, as it did on
+    # the pages, and each group depends only on its own lines.
+    lines = lines.copy()
+    for col in ("order_date", "despatch_date"):
+        lines[col] = pd.to_datetime(lines[col]).dt.strftime("%Y-%m-%d")
+
+    orders = lines.drop_duplicates(subset=["order_id"] + ORDER_KEYS)
+    order_rollup = (
+        orders.groupby(ORDER_KEYS, dropna=False)
+        .agg(orders=("order_id", "nunique"), order_value=("order_value", "sum"))
+        .reset_index()
+    )
+    sku_rollup = (
+        lines.groupby(ORDER_KEYS + ["product_sku", "product_name"], dropna=False)
+        .agg(
+            product_qty=("product_qty", "sum"),
+            order_lines=("order_id", "size"),
+            orders=("order_id", "nunique"),
+        )
+        .reset_index()
+    )
+    postcode_rollup = (
+        lines.groupby(["despatch_date", "order_channel", "order_cust_postcode"], dropna=False)
+        .size()
+        .rename("order_lines")
+        .reset_index()
+    )
+    return {"order_rollup": order_rollup, "sku_rollup": sku_rollup, "postcode_rollup": postcode_rollup}
+
+
+def _last_refresh(pool):
+    # refreshed_at of the last refresh (epoch seconds), or None before the first build
+    with pool.connection() as conn:
+        meta = conn.execute("SELECT refreshed_at FROM rollup_meta WHERE id = 1").fetchone()
+    return None if meta is None else meta[0]
+
+
+def refresh_rollups(days=REFRESH_DAYS, full=False):
+    # Recompute every group touching the last `days` days, reaching back to the day of
+    # the last refresh when that was longer ago (or the whole history window)
+    pool = get_store_pool()
+    with _refresh_lock:
+        refreshed_at = _last_refresh(pool)
+        start = history_start()
+        if full or refreshed_at is None:
+            window_start = start
+        else:
+            recent = pd.Timestamp.now().normalize() - pd.Timedelta(days=days - 1)
+            last_refresh_day = pd.Timestamp.fromtimestamp(refreshed_at).normalize()
+            window_start = max(start, min(recent, last_refresh_day))
+        window = window_start.strftime("%Y-%m-%d")
+
+        lines = run_query(
+            SOURCE_QUERY,
+            [window_start.to_pydatetime(), window_start.to_pydatetime(), start.to_pydatetime()],
+            dtypes={"order_date": "datetime64[ns]", "despatch_date": "datetime64[ns]", "order_value": "float64"},
+        )
+        tables = build_rollups(lines)
+        # Postcode rows are keyed by despatch day only, so keep just the complete days
+        postcodes = tables["postcode_rollup"]
+        tables["postcode_rollup"] = postcodes[postcodes["despatch_date"] >= window]
+
+        cutoff = start.strftime("%Y-%m-%d")
+        with pool.connection() as conn:
+            if window_start == start:
+                for table in tables:
+                    conn.execute(f"DELETE FROM {table}")
+            else:
+                # Replace the recomputed groups, undespatched ones included, and prune days
+                # that left the history window
+                for table in ("order_rollup", "sku_rollup"):
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE order_date >= ? OR despatch_date >= ? "
+                        f"OR despatch_date IS NULL OR (order_date < ? AND despatch_date < ?)",
+                        (window, window, cutoff, cutoff),
+                    )
+                conn.execute("DELETE FROM postcode_rollup WHERE despatch_date >= ? OR despatch_date < ?", (window, cutoff))
+            for table, frame in tables.items():
+                frame.to_sql(table, conn, if_exists="append", index=False)
+            conn.execute(
+                "INSERT OR REPLACE INTO rollup_meta (id, history_start, refreshed_at) VALUES (1, ?, ?)",
+                (cutoff, time.time()),
+            )
+            conn.commit()
+        return {table: len(frame) for table, frame in tables.items()}
+
+
+def ensure_fresh(max_age_seconds=3600, days=REFRESH_DAYS):
+    # Checked again under the refresh lock: the three rollup datasets all call this, and
+    # whichever waits on another's refresh finds the store fresh rather than refreshing again
+    pool = get_store_pool()
+
+    def stale():
+        refreshed_at = _last_refresh(pool)
+        return refreshed_at is None or time.time() - refreshed_at > max_age_seconds
+
+    if stale():
+        with _refresh_lock:
+            if stale():
+                refresh_rollups(days=days)
+
+
+# ------------------ READ ------------------
+def read_rollup(table, despatch_start=None, despatch_end=None, order_start=None, order_end=None, channels=None):
+    clauses, params = [], []
+    for col, value, op in (
+        ("despatch_date", despatch_start, ">="),
+        ("despatch_date", despatch_end, "<="),
+        ("order_date", order_start, ">="),
+        ("order_date", order_end, "<="),
+    ):
+        if value is not None:
+            clauses.append(f"{col} {op} ?")
+            params.append(pd.Timestamp(value).strftime("%Y-%m-%d"))
+    if channels is not None:
+        clauses.append(f"order_channel IN ({', '.join('?' * len(channels))})" if channels else "1 = 0")
+        params.extend(channels)
+
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    df = get_store_pool().query(f"SELECT * FROM {table}{where}", params=params)
+    for col in ("order_date", "despatch_date"):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the OrdersDespatch daily rollups")
+    parser.add_argument("--days", type=int, default=REFRESH_DAYS, help="number of most recent days to recompute")
+    parser.add_argument("--full", action="store_true", help="rebuild the whole history window")
+    args = parser.parse_args()
+    print(refresh_rollups(days=args.days, full=args.full))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# Smart Search without scanning order lines. Each searchable field gets a trigram index
+# over its distinct lowercased values; a term resolves to matching value ids, those map to
+# product keys (one per distinct SKU/name/category combination), and rows are selected
+# by looking their key code up in a boolean table, i.e. one isin over an int code.
+
+NGRAM = 3
+
+
+class SubstringIndex:
+    # Literal, case-insensitive substring lookup over a list of distinct strings
+
+    def __init__(self, values, n=NGRAM):
+        self.n = n
+        self.values = [str(value).lower() for value in values]
+        postings = {}
+        for i, value in enumerate(self.values):
+            for gram in {value[j:j + n] for j in range(len(value) - n + 1)}:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def lookup(self, term):
+        term = term.lower()
+        if len(term) < self.n:
+            candidates = range(len(self.values))
+        else:
+            candidates = None
+            # Rarest grams first keeps the running intersection small
+            grams = sorted({term[j:j + self.n] for j in range(len(term) - self.n + 1)},
+                           key=lambda gram: len(self.postings.get(gram, ())))
+            for gram in grams:
+                ids = self.postings.get(gram)
+                if ids is None:
+                    return np.empty(0, dtype=np.int32)
+                candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+                if not len(candidates):
+                    return candidates
+        # Grams only narrow the candidates; the substring check makes the match exact
+        return np.fromiter((i for i in candidates if term in self.values[i]), dtype=np.int32)
+
+
+class ProductSearchIndex:
+    def __init__(self, df, fields=('product_sku', 'product_name', 'product_category')):
+        self.fields = list(fields)
+        codes, self.indexes = [], {}
+        for field in self.fields:
+            column = df[field]
+            if not isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.astype('category')
+            # Missing values get code -1 and never match a term
+            codes.append(column.cat.codes.to_numpy().astype(np.int64))
+            self.indexes[field] = SubstringIndex(column.cat.categories)
+
+        # Product key = distinct combination of the field values; every row gets its key code
+        combined = np.zeros(len(df), dtype=np.int64)
+        for field, field_codes in zip(self.fields, codes):
+            combined = combined * (len(self.indexes[field].values) + 1) + (field_codes + 1)
+        self.row_keys, key_values = pd.factorize(combined, sort=False)
+        # Field value id per product key, decoded back out of the combined code
+        self.key_codes = {}
+        remainder = np.asarray(key_values, dtype=np.int64)
+        for field in reversed(self.fields):
+            base = len(self.indexes[field].values) + 1
+            self.key_codes[field] = remainder % base - 1
+            remainder = remainder // base
+        self.n_keys = len(key_values)
+
+    def match_keys(self, field, terms):
+        # Terms within a field are ORed: keys whose value contains any of them
+        matched = np.zeros(len(self.indexes[field].values), dtype=bool)
+        for term in terms:
+            matched[self.indexes[field].lookup(term)] = True
+        codes = self.key_codes[field]
+        return (codes >= 0) & matched[np.maximum(codes, 0)]
+
+    def mask(self, terms_by_field):
+        # Fields are ANDed; returns a row mask aligned with the indexed frame
+        selected = np.ones(self.n_keys, dtype=bool)
+        for field, terms in terms_by_field.items():
+            if terms:
+                selected &= self.match_keys(field, terms)
+        return selected[self.row_keys]
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.db import run_query
+
+# Local Parquet copy of OrdersDespatch, partitioned by despatch month. sync_store() only
+# fetches rows despatched in the last few days before the despatch_date high-water mark
+# or later, and rewrites the partitions they land in, so a server restart costs seconds
+# instead of a full table scan over ODBC. A line backdated to a despatch day older than
+# that overlap is not picked up until the next full sync (python -m utils.store --full).
+
+STORE_DIR = os.environ.get("MPTC_STORE_DIR", os.path.join("data", "orders_despatch"))
+STORE_START = "2023-06-01"
+MANIFEST = "_manifest.json"
+LAST_SALE = "_last_sale.parquet"
+OPEN_PARTITION = "despatch_month=none"
+# Days before the high-water-mark day that every delta sync fetches again
+SYNC_OVERLAP_DAYS = 7
+
+STORE_SCHEMA = pa.schema([
+    ("order_id", pa.string()),
+    ("order_channel", pa.string()),
+    ("order_date", pa.timestamp("ns")),
+    ("despatch_date", pa.timestamp("ns")),
+    ("order_value", pa.float64()),
+    ("order_cust_postcode", pa.string()),
+    ("customer_name", pa.string()),
+    ("order_courier_service", pa.string()),
+    ("product_sku", pa.string()),
+    ("product_name", pa.string()),
+    ("product_qty", pa.int64()),
+    ("product_price", pa.float64()),
+])
+
+LAST_SALE_KEYS = ["product_sku", "product_name"]
+LAST_SALE_SCHEMA = pa.schema([
+    ("product_sku", pa.string()),
+    ("product_name", pa.string()),
+    ("order_date", pa.timestamp("ns")),
+])
+
+COLUMNS = ", ".join(STORE_SCHEMA.names)
+FETCH_DTYPES = {"order_date": "datetime64[ns]", "despatch_date": "datetime64[ns]"}
+
+# _sync_lock serialises syncs, fetch included. _files_lock is only held while the store's
+# files are rewritten or read, so readers never see a half-rewritten store and only wait
+# for the writes, not the fetch. It is re-entrant because a sync reads the store too.
+_sync_lock = threading.Lock()
+_files_lock = threading.RLock()
+
+
+def _read_manifest():
+    path = os.path.join(STORE_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest):
+    path = os.path.join(STORE_DIR, MANIFEST)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _partition_path(name):
+    return os.path.join(STORE_DIR, name, "part.parquet")
+
+
+def _write_partition(name, df):
+    path = _partition_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df.copy()
+    df["order_id"] = df["order_id"].astype("string")
+    table = pa.Table.from_pandas(df[STORE_SCHEMA.names], schema=STORE_SCHEMA, preserve_index=False)
+    # Dot-prefixed temp files are skipped by the dataset reader while the write is in flight
+    tmp_path = os.path.join(os.path.dirname(path), ".part.parquet.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_partition(name):
+    path = _partition_path(name)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=STORE_SCHEMA.names)
+    return pq.read_table(path, schema=STORE_SCHEMA).to_pandas()
+
+
+# ------------------ LAST SALE INDEX ------------------
+# Latest order_date per (product_sku, product_name) over the despatched partitions. Rows
+# only ever arrive (the overlap days are refetched as a superset), so a delta sync folds
+# the fetched lines in with a max instead of regrouping the whole store.
+def _last_sales(lines):
+    return lines.groupby(LAST_SALE_KEYS)["order_date"].max().reset_index()
+
+
+def _merge_last_sales(*indexes):
+    return _last_sales(pd.concat(indexes, ignore_index=True))
+
+
+def _write_last_sales(df):
+    path = os.path.join(STORE_DIR, LAST_SALE)
+    table = pa.Table.from_pandas(df[LAST_SALE_SCHEMA.names], schema=LAST_SALE_SCHEMA, preserve_index=False)
+    tmp_path = os.path.join(STORE_DIR, f".{LAST_SALE}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_last_sales():
+    path = os.path.join(STORE_DIR, LAST_SALE)
+    if not os.path.exists(path):
+        return None
+    return pq.read_table(path, schema=LAST_SALE_SCHEMA).to_pandas()
+
+
+def _rebuild_last_sales():
+    lines = load_orders(columns=LAST_SALE_KEYS + ["order_date", "despatch_date"])
+    return _last_sales(lines[lines["despatch_date"].notna()])
+
+
+def load_last_sales():
+    # Despatched history from the index plus the open partition, which changes freely
+    with _files_lock:
+        settled = _read_last_sales()
+        if settled is None:
+            settled = _rebuild_last_sales()
+        open_lines = _read_partition(OPEN_PARTITION)
+    return _merge_last_sales(settled, open_lines[LAST_SALE_KEYS + ["order_date"]])
+
+
+def _split_by_month(df):
+    months = df["despatch_date"].dt.strftime("%Y-%m")
+    for month, part in df[months.notna()].groupby(months[months.notna()]):
+        yield month, part
+
+
+def high_water_mark():
+    manifest = _read_manifest()
+    return pd.Timestamp(manifest["high_water_mark"]) if manifest else None
+
+
+def sync_store(full=False):
+    with _sync_lock:
+        manifest = _read_manifest()
+        start = pd.Timestamp(STORE_START).to_pydatetime()
+        # Not-yet-despatched lines can change at any time, so that partition is always refetched
+        open_lines = run_query(
+            f"SELECT {COLUMNS} FROM OrdersDespatch WHERE despatch_date IS NULL AND order_date >= ?", [start],
+            dtypes=FETCH_DTYPES,
+        )
+
+        if full or manifest is None:
+            mode = "full"
+            lines = run_query(
+                f"SELECT {COLUMNS} FROM OrdersDespatch WHERE order_date >= ? AND despatch_date IS NOT NULL", [start],
+                dtypes=FETCH_DTYPES,
+            )
+            since = None
+        else:
+            mode = "delta"
+            # Refetch the high-water-mark day and the days before it, so rows inserted late
+            # or backdated within the overlap are not missed
+            since = pd.Timestamp(manifest["high_water_mark"]).normalize() - pd.Timedelta(days=SYNC_OVERLAP_DAYS)
+            lines = run_query(
+                f"SELECT {COLUMNS} FROM OrdersDespatch WHERE despatch_date >= ? AND order_date >= ?",
+                [since.to_pydatetime(), start],
+                dtypes=FETCH_DTYPES,
+            )
+
+        for col in ("order_date", "despatch_date"):
+            lines[col] = pd.to_datetime(lines[col])
+            open_lines[col] = pd.to_datetime(open_lines[col])
+
+        with _files_lock:
+            if mode == "full" and os.path.isdir(STORE_DIR):
+                for name in os.listdir(STORE_DIR):
+                    if name.startswith("despatch_month="):
+                        os.remove(_partition_path(name))
+                        os.rmdir(os.path.join(STORE_DIR, name))
+
+            for month, part in _split_by_month(lines):
+                name = f"despatch_month={month}"
+                if since is not None:
+                    existing = _read_partition(name)
+                    existing = existing[existing["despatch_date"] < since]
+                    part = pd.concat([existing, part], ignore_index=True)
+                _write_partition(name, part)
+            _write_partition(OPEN_PARTITION, open_lines)
+
+            last_sales = _last_sales(lines)
+            if since is not None:
+                previous = _read_last_sales()
+                last_sales = _merge_last_sales(_rebuild_last_sales() if previous is None else previous, last_sales)
+            _write_last_sales(last_sales)
+
+            latest = lines["despatch_date"].max()
+            previous = pd.Timestamp(manifest["high_water_mark"]) if manifest else pd.NaT
+            hwm = max(d for d in (latest, previous, pd.Timestamp(STORE_START)) if pd.notna(d))
+            _write_manifest({"high_water_mark": hwm.isoformat(), "synced_at": time.time()})
+        return {"mode": mode, "rows": len(lines), "open_rows": len(open_lines), "high_water_mark": hwm}
+
+
+def load_orders(columns=None, order_start=None):
+    # Column projection and the order_date predicate are pushed into the Parquet reader
+    filters = [("order_date", ">=", pd.Timestamp(order_start))] if order_start is not None else None
+    with _files_lock:
+        table = pq.read_table(STORE_DIR, columns=columns, filters=filters, schema=STORE_SCHEMA, partitioning="hive")
+    return table.to_pandas()
+
+
+def load_order_lines(columns, order_start=STORE_START):
+    # Store projection plus the Products category, matching the old
+    # "OrdersDespatch od LEFT JOIN Products p" page queries column for column
+    store_columns = [col for col in columns if col != "product_category"]
+    if "product_sku" not in store_columns:
+        store_columns.append("product_sku")
+    df = load_orders(columns=store_columns, order_start=order_start)
+    if "product_category" in columns:
+        products = run_query("SELECT product_sku, product_category FROM Products")
+        products["product_sku"] = products["product_sku"].astype("string")
+        df = df.merge(products, on="product_sku", how="left")
+    return df[columns]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the local OrdersDespatch store")
+    parser.add_argument("--full", action="store_true", help="reload the whole store instead of the delta")
+    args = parser.parse_args()
+    print(sync_store(full=args.full))
@@ -0,0 +1,29 @@
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+
+class RerunTimer:
+    # Wall-clock timings for one script rerun. The sidebar table is redrawn as each
+    # section finishes, so reruns cut short by st.stop() still show what ran.
+
+    def __init__(self, title="⏱️ Rerun Timing"):
+        self.started = time.perf_counter()
+        self.sections = []
+        self._placeholder = st.sidebar.expander(title).empty()
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections.append((name, time.perf_counter() - start))
+            self._render()
+
+    def _render(self):
+        rows = [{"section": name, "ms": round(seconds * 1000, 1)} for name, seconds in self.sections]
+        rows.append({"section": "rerun so far", "ms": round((time.perf_counter() - self.started) * 1000, 1)})
+        self._placeholder.dataframe(pd.DataFrame(rows), hide_index=True)
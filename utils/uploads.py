@@ -0,0 +1,113 @@
+import hashlib
+import io
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from openpyxl import load_workbook
+
+# Parsing for files uploaded to the report pages. Only the columns a report needs are
+# read: workbooks are streamed row by row from a read-only openpyxl sheet, CSVs are read
+# in chunks, and each column gets its dtype as it is parsed. Results are cached by the
+# file's content hash, so rerunning a page with the same uploads does not parse again.
+
+CSV_CHUNK_ROWS = 100_000
+UPLOAD_CACHE_ENTRIES = 16
+
+# dtypes values: "str" (text, blanks stay missing), "number" (int64 when every value is
+# whole, float64 otherwise, like read_excel infers) or any pandas dtype
+
+
+def content_hash(uploaded):
+    return hashlib.sha256(uploaded.getvalue()).hexdigest()
+
+
+def _is_workbook(name):
+    return name.lower().endswith((".xlsx", ".xlsm"))
+
+
+def _header_names(cells):
+    return [f"Unnamed: {i}" if value is None else value for i, value in enumerate(cells)]
+
+
+def _apply_dtype(series, dtype):
+    if dtype == "str":
+        return series.astype(str).where(series.notna(), np.nan)
+    if dtype == "number":
+        return pd.to_numeric(series, errors="coerce")
+    return series.astype(dtype)
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def _read_headers(digest, name, _data):
+    if _is_workbook(name):
+        workbook = load_workbook(io.BytesIO(_data), read_only=True, data_only=True)
+        try:
+            first = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return _header_names(first)
+    return list(pd.read_csv(io.BytesIO(_data), nrows=0).columns)
+
+
+def _read_workbook(data, columns):
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = _header_names(next(rows, ()))
+        positions = [headers.index(col) for col in columns]
+        last = max(positions) + 1
+        values = [[] for _ in columns]
+        for row in rows:
+            row = row[:last]
+            if len(row) < last:
+                row = row + (None,) * (last - len(row))
+            picked = [row[i] for i in positions]
+            # Rows empty in every wanted column are skipped, as read_excel skips blank rows
+            if all(value is None for value in picked):
+                continue
+            for target, value in zip(values, picked):
+                target.append(value)
+    finally:
+        workbook.close()
+    return pd.DataFrame({col: pd.Series(vals, dtype=object) for col, vals in zip(columns, values)})
+
+
+def _read_csv(data, columns, dtypes):
+    # Text columns are parsed as text straight away; the rest are converted per chunk
+    csv_dtypes = {col: str for col, dtype in dtypes.items() if dtype == "str"}
+    chunks = pd.read_csv(io.BytesIO(data), usecols=columns, dtype=csv_dtypes, chunksize=CSV_CHUNK_ROWS)
+    frames = []
+    for chunk in chunks:
+        for col, dtype in dtypes.items():
+            if dtype != "str":
+                chunk[col] = _apply_dtype(chunk[col], dtype)
+        frames.append(chunk[columns])
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def _read_columns(digest, name, columns, dtypes, _data):
+    columns, dtypes = list(columns), dict(dtypes)
+    if not _is_workbook(name):
+        return _read_csv(_data, columns, dtypes)
+    df = _read_workbook(_data, columns)
+    for col in columns:
+        if col in dtypes:
+            df[col] = _apply_dtype(df[col], dtypes[col])
+        else:
+            df[col] = df[col].where(df[col].notna(), np.nan).infer_objects()
+    return df
+
+
+def upload_columns(uploaded):
+    # Header row of the first sheet (or the CSV), for picking the columns to read
+    return _read_headers(content_hash(uploaded), uploaded.name, uploaded.getvalue())
+
+
+def read_upload(uploaded, columns, dtypes=None):
+    # Only `columns` (header names as they appear in the file), in that order
+    dtypes = dtypes or {}
+    return _read_columns(
+        content_hash(uploaded), uploaded.name, tuple(columns), tuple(sorted(dtypes.items())), uploaded.getvalue()
+    )